@@ -28,7 +28,7 @@ system requirements:
   - Q to execute SQL-like queries on CSV files
         http://harelba.github.io/q/
   - The following Python libraries:
-        dominate, configobj
+        configobj
 """
 
 __description__ = 'Simple Python script for security auditing purposes.'
@@ -38,20 +38,32 @@ __date__ = '2017/06/25'
 
 import io
 import os
+import copy
+import codecs
 import re
-import csv
+import json
+import pickle
+import hashlib
 import ast
 import sys
+import mmap
 import time
-import binascii
-import textwrap
-import dominate
+import signal
+import heapq
+import tempfile
 
-from argparse import *
-from dominate.tags import *
-from configobj import ConfigObj
-from subprocess import check_call
-from subprocess import check_output
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
+
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from collections import namedtuple
+from threading import Lock
+from threading import local
+from contextlib import contextmanager
 
 banner = """
                  ____                  _     _____ _______
@@ -62,46 +74,209 @@ banner = """
                 |____/ \___|_| |_|\___|_| |_|_____|  |_|
 """.format(__version__)
 
-print(banner)
 
-parser = ArgumentParser(
-    formatter_class=RawDescriptionHelpFormatter,
-    description=__doc__,
-    prog='benchit'
+benchmarks = OrderedDict()
+line_indexes = OrderedDict()
+dirlist_indexes = OrderedDict()
+databases = OrderedDict()
+cache_lock = Lock()
+worker = None
+native_checks = {}
+pattern_infos = {}
+chapter_keys = {}
+colon_files = OrderedDict()
+special_files = OrderedDict()
+decoded_files = OrderedDict()
+registry_indexes = OrderedDict()
+config_indexes = OrderedDict()
+combined_patterns = OrderedDict()
+
+# Platforms an auditor can audit a host as
+PLATFORMS = ('database', 'linux', 'windows')
+
+# Platform of the benchmarks of each module of benchit.ini
+MODULES = {'Database': 'database', 'Linux': 'linux', 'Windows': 'windows'}
+
+# Number of loaded benchmarks kept, one per version of a CSV file
+BENCHMARK_CACHE = 8
+
+# Version header of compiled benchmarks, bumped when their layout changes
+BENCHMARK_HEADER = 'BENCHIT 3 {}\n'.format(__version__).encode('ascii')
+
+# Errors unpickling a damaged or foreign file may raise
+UNPICKLING_ERRORS = (IOError, EOFError, ValueError, TypeError, KeyError,
+                     IndexError, AttributeError, ImportError,
+                     pickle.UnpicklingError)
+
+# Files smaller than this are scanned faster than they are indexed
+INDEX_THRESHOLD = 1 << 20
+
+# Number of line indexes kept, a file is checked once for each category
+LINE_INDEX_CACHE = 8
+
+# Number of directory listing indexes kept, one is needed per host
+DIRLIST_INDEX_CACHE = 4
+
+# Number of parsed registry exports kept, one is needed per hive exported
+REGISTRY_INDEX_CACHE = 4
+
+# Prefix of the patterns looking up a registry value by its key path, e.g.
+# "key:HKLM\SYSTEM\CurrentControlSet\Control\Lsa\NoLMHash"
+KEY_PREFIX = 'key:'
+
+# Prefix of the patterns looking up a setting of a parsed configuration file,
+# e.g. "conf:PermitRootLogin" or "conf:net.ipv4.ip_forward"
+CONF_PREFIX = 'conf:'
+
+# "KEY value" and "KEY=value" lines of configuration files
+CONFIG_LINE = re.compile(r'([^\s=]+)\s*=?\s*(.*)$')
+
+# Number of parsed configuration files kept, a host has several of them
+CONFIG_INDEX_CACHE = 16
+
+# Number of combined alternations kept, most files of a host share a few
+COMBINED_PATTERN_CACHE = 64
+
+# Full names of the abbreviated registry hives
+HIVES = {
+    'HKLM': 'HKEY_LOCAL_MACHINE',
+    'HKCU': 'HKEY_CURRENT_USER',
+    'HKCR': 'HKEY_CLASSES_ROOT',
+    'HKU': 'HKEY_USERS',
+    'HKCC': 'HKEY_CURRENT_CONFIG',
+}
+
+# Registry value types of the "hex(n):" data of registry exports
+REGISTRY_TYPES = {
+    0: 'REG_NONE',
+    1: 'REG_SZ',
+    2: 'REG_EXPAND_SZ',
+    3: 'REG_BINARY',
+    4: 'REG_DWORD',
+    5: 'REG_DWORD_BIG_ENDIAN',
+    7: 'REG_MULTI_SZ',
+    11: 'REG_QWORD',
+}
+
+# Value lines of registry exports: "name"=data or @=data for the default
+REGISTRY_VALUE = re.compile(r'^(?:"((?:[^"\\]|\\.)*)"|(@))=(.*)$')
+
+# Number of parsed files kept for the built-in checks
+COLON_FILE_CACHE = 16
+
+# Characters of decoded files with a byte order mark kept, e.g. UTF-16
+# registry exports searched by several rows
+DECODED_FILE_CACHE = 64 << 20
+
+# Files to decode larger than this are searched chunk by chunk
+DECODED_STREAM_SIZE = 32 << 20
+
+# Byte order marks of the encodings files are decoded from, UTF-8 otherwise
+BOMS = (
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
 )
 
-module = parser.add_mutually_exclusive_group(required=True)
-module.add_argument('-d, --database', dest='database', action='store_true',
-                    help='audit Oracle database')
-module.add_argument('-l, --linux', dest='linux', action='store_true',
-                    help='audit Linux system')
-module.add_argument('-w, --windows', dest='windows', action='store_true',
-                    help='audit Windows system')
-
-parser.add_argument('-o, --output', dest='output', default='results',
-                    help='output filename (default results_{timestamp}.html)')
-parser.add_argument('-p, --path', dest='path', default='.',
-                    help='base path to target directory (default .)')
-parser.add_argument('-v, --verbose', dest='verbose', action='store_true',
-                    help='run in verbose mode')
-parser.add_argument('-s, --skip-dirlist', dest='skipdirlist', action='store_true',
-                    help='skip directory list checking (default false)')
-parser.add_argument('--debug', dest='debug', action='store_true',
-                    help='run in debug mode (default false)')
-parser.add_argument('--no-color', dest='nocolor', action='store_true',
-                    help='disable colored output (default false)')
-parser.add_argument('-i, --ignore-case', dest='ignorecase', action='store_true',
-                    help='perform case-insensitive matching (default false)')
-
-args = parser.parse_args()
-
-items = {}
-audit = {}
-results = []
-total = 0
-passed = 0
-failed = 0
-errors = 0
+# Number of exported database tables kept in memory
+DATABASE_CACHE = 16
+
+# Name of the table a query runs on instead of the exported CSV file
+DATABASE_TABLE = 'export'
+
+# Values of integer and real columns of exported CSV files
+INTEGER = re.compile(r'^[-+]?\d+$')
+REAL = re.compile(r'^[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?$')
+
+# Numeric and other parts of a chapter number, e.g. "9", "2", "1" and "a"
+CHAPTER_PARTS = re.compile(r'\d+|[^\d.]+')
+
+# Global inline flags, only allowed at the start of a whole pattern
+INLINE_FLAGS = re.compile(r'\(\?[aiLmsux]+\)')
+
+# Contents bytes patterns see differently than str patterns would
+NOT_PLAIN = re.compile(br'[^\x00-\x7f]|\r')
+
+# Templates of the HTML report, rows are written one at a time
+HTML_STYLE = """\
+pre { margin: 0; font-size: 16px; font-weight: bold; }
+h1, p { margin-bottom: 0; }
+h4 { margin: 0; padding: 0; }
+ul { margin-top: 0; }
+table { width: 100%; border-collapse: collapse; border: 1px solid black; }
+th, td { border: 1px solid black; padding: 3px; text-align: left; }
+th { background: black; color: white; }
+th:nth-child(1) { width: 5%; }
+th:nth-child(2) { width: 32%; }
+th:nth-child(3) { width: 30%; }
+th:nth-child(4), th:nth-child(5), th:nth-child(6) { width: 10%; }
+td.Pass, td.Fail, td.Error { text-align: center; }
+td.Pass { background: lime; }
+td.Fail { background: red; }
+td.Error { background: yellow; }
+"""
+
+HTML_HEADER = """\
+<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<style>
+{style}</style>
+</head>
+<body>
+<pre>{banner}</pre>
+<h1>{title}</h1>
+<h4>{benchmark}</h4>
+<p>Performed {total} tests in total:</p>
+<ul>
+<li>Pass = {passed} ({passed_percent:.0f}%)</li>
+<li>Fail = {failed} ({failed_percent:.0f}%)</li>
+<li>Error = {errors} ({errors_percent:.0f}%)</li>
+</ul>
+<table>
+<thead><tr>{headers}</tr></thead>
+<tbody>
+"""
+
+HTML_ROW = """\
+<tr><td>{0}</td><td>{1}</td><td>{2}</td><td>{3}</td><td>{4}</td><td>{5}</td><td class="{6}">{6}</td></tr>
+"""
+
+HTML_FOOTER = """\
+</tbody>
+</table>
+</body>
+</html>
+"""
+
+# Number of results sorted in memory before they are spooled to disk
+SPOOL_ROWS = 100000
+
+# Chunk size of files searched line by line in streaming mode
+CHUNK_SIZE = 1 << 20
+
+# Warning about benchmark patterns prone to catastrophic backtracking
+BACKTRACKING_WARNING = 'pattern may backtrack catastrophically'
+
+# Found in place of the groups of a pattern which ran out of time
+TIMED_OUT = object()
+
+# Found in place of the groups of a pattern whose search process died
+SEARCH_FAILED = object()
+
+# Character classes of the parsed categories of a pattern
+CATEGORIES = {
+    sre_parse.CATEGORY_DIGIT: r'\d',
+    sre_parse.CATEGORY_NOT_DIGIT: r'\D',
+    sre_parse.CATEGORY_SPACE: r'\s',
+    sre_parse.CATEGORY_NOT_SPACE: r'\S',
+    sre_parse.CATEGORY_WORD: r'\w',
+    sre_parse.CATEGORY_NOT_WORD: r'\W',
+}
 
 headers = [
     'Chapter',
@@ -113,48 +288,1207 @@ headers = [
     'Result'
 ]
 
-if args.nocolor:
-    WHITE = ''
-    GREY = ''
-    RED = ''
-    GREEN = ''
-    BLUE = ''
-else:
-    WHITE = '\033[0m'
-    GREY = '\033[90m'
-    RED = '\033[91m'
-    GREEN = '\033[92m'
-    BLUE = '\033[94m'
+WHITE = '\033[0m'
+GREY = '\033[90m'
+RED = '\033[91m'
+GREEN = '\033[92m'
+BLUE = '\033[94m'
 
 
-def main():
-    global audit, results, total, passed, failed, errors
+class Context(local):
+    """The auditor, options and output of the audit running in a thread."""
+
+    auditor = None
+    options = None
+    output = None
+    profile = None
+
+
+class Options(object):
+    """Options of the audit running in the current thread."""
+
+    def __getattr__(self, name):
+        return getattr(context.options, name)
+
+
+context = Context()
+args = Options()
+
+
+class NullOutput(object):
+    """Output of quiet auditors, discards everything written to it."""
+
+    def write(self, text):
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+class PatternCache(object):
+    """Compiled regex patterns shared by every file and host in a run."""
+
+    def __init__(self):
+        self.compiled = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, pattern, flags=0):
+        """Returns the compiled pattern, compiling it on the first request."""
+        key = (pattern, flags)
+        try:
+            regex = self.compiled[key]
+            self.hits += 1
+        except KeyError:
+            regex = self.compiled[key] = re.compile(pattern, flags)
+            self.misses += 1
+        return regex
+
+    def __len__(self):
+        return len(self.compiled)
+
+
+patterns = PatternCache()
+
+
+class AuditResult(object):
+    """Thread-safe accumulator of the results of an audit.
+
+    Results are stored column by column instead of one tuple per check, the
+    repeated strings (titles, summaries, values) are interned and the
+    outcome of each check is kept as a single byte. With a sink, results
+    are forwarded to it as they come in and only counted here. Transient
+    results, such as checks which ran out of time, are counted apart as
+    they must not be taken over by later runs.
+    """
+
+    __slots__ = ('columns', 'outcomes', 'total', 'passed', 'failed', 'errors',
+                 'transient', 'lock', 'sink', 'view')
+
+    codes = ('Pass', 'Fail', 'Error')
+
+    def __init__(self, sink=None):
+        self.columns = ([], [], [], [], [], [])
+        self.outcomes = array('B')
+        self.total = 0
+        self.passed = 0
+        self.failed = 0
+        self.errors = 0
+        self.transient = 0
+        self.lock = Lock()
+        self.sink = sink
+        self.view = None
+
+    def add(self, number, title, summary, default, actual, expected, result,
+            transient=False):
+        """Records the result of a single check."""
+        code = self.codes.index(result)
+        row = (number, title, summary, default, actual, expected)
+        with self.lock:
+            self.view = None
+            if self.sink is not None:
+                self.sink.add(row + (result,))
+            else:
+                for column, value in zip(self.columns, row):
+                    column.append(sys.intern(value))
+                self.outcomes.append(code)
+            self.count(code, 1)
+            self.transient += transient
+
+    def merge(self, other):
+        """Appends every result of another accumulator, e.g. of a worker."""
+        with self.lock:
+            self.view = None
+            if self.sink is not None:
+                for row in other:
+                    self.sink.add(row)
+            else:
+                for column, values in zip(self.columns, other.columns):
+                    column.extend(sys.intern(value) for value in values)
+                self.outcomes.extend(other.outcomes)
+            self.total += other.total
+            self.passed += other.passed
+            self.failed += other.failed
+            self.errors += other.errors
+            self.transient += other.transient
+
+    def count(self, code, n):
+        """Updates the counters with n results of the given outcome."""
+        self.total += n
+        if code == 0:
+            self.passed += n
+        elif code == 1:
+            self.failed += n
+        else:
+            self.errors += n
+
+    def rows(self):
+        """Returns the distinct results ordered by chapter.
+
+        Results are deduplicated and sorted only once, every report writer
+        shares the returned view.
+        """
+        with self.lock:
+            if self.view is None:
+                if self.sink is not None:
+                    self.view = self.sink.compact()
+                else:
+                    self.view = tuple(sorted(set(self), key=row_key))
+            return self.view
+
+    def __len__(self):
+        return self.total
+
+    def __iter__(self):
+        codes = self.codes
+        for *row, code in zip(*self.columns, self.outcomes):
+            yield tuple(row) + (codes[code],)
+
+    def __getstate__(self):
+        return (self.columns, self.outcomes, self.total, self.passed,
+                self.failed, self.errors, self.transient)
+
+    def __setstate__(self, state):
+        (self.columns, self.outcomes, self.total, self.passed, self.failed,
+         self.errors, self.transient) = state
+        self.lock = Lock()
+        self.sink = None
+        self.view = None
+
+
+class ResultSpool(object):
+    """Sink sorting the results of an audit by chapter in bounded memory.
+
+    Results are buffered and every SPOOL_ROWS of them are sorted and spooled
+    to a temporary file. Reading the spool merges these sorted runs, so the
+    rows come out in chapter order without ever holding all of them.
+    """
+
+    def __init__(self, limit=SPOOL_ROWS):
+        self.limit = limit
+        self.buffer = set()
+        self.runs = []
+
+    def add(self, row):
+        """Adds a result, spooling the buffer once it is full."""
+        self.buffer.add(row)
+        if len(self.buffer) >= self.limit:
+            self.spool()
+
+    def spool(self):
+        """Writes the buffered results to disk as a sorted run."""
+        run = tempfile.TemporaryFile(prefix='benchit-')
+        pickler = pickle.Pickler(run, pickle.HIGHEST_PROTOCOL)
+        for row in sorted(self.buffer, key=row_key):
+            pickler.dump(row)
+            # Rows are independent, do not let the memo hold all of them
+            pickler.clear_memo()
+        self.buffer = set()
+        self.runs.append(run)
+
+    def compact(self):
+        """Merges the results into a single sorted run read by every writer.
+
+        Returns the spool, or the sorted results if they were never spooled.
+        """
+        if not self.runs:
+            return tuple(sorted(self.buffer, key=row_key))
+        run = tempfile.TemporaryFile(prefix='benchit-')
+        pickler = pickle.Pickler(run, pickle.HIGHEST_PROTOCOL)
+        for row in self:
+            pickler.dump(row)
+            pickler.clear_memo()
+        self.close()
+        self.runs.append(run)
+        return self
+
+    def read(self, run):
+        """Reads the results of a sorted run back."""
+        run.seek(0)
+        unpickler = pickle.Unpickler(run)
+        while True:
+            try:
+                yield unpickler.load()
+            except EOFError:
+                return
+
+    def close(self):
+        """Removes the runs spooled to disk."""
+        for run in self.runs:
+            run.close()
+        self.runs = []
+        self.buffer = set()
+
+    def __iter__(self):
+        runs = [self.read(run) for run in self.runs]
+        runs.append(iter(sorted(self.buffer, key=row_key)))
+        previous = None
+        for row in heapq.merge(*runs, key=row_key):
+            # The same result may have been spooled in several runs
+            if row != previous:
+                yield row
+            previous = row
+
+
+class LineIndex(object):
+    """Offsets of the lines of a file grouped by their first token.
+
+    Patterns anchored to the beginning of a line with a literal prefix (e.g.
+    "^Protocol[ \\t]+(\\d)$") can only match on lines whose first token
+    starts with that prefix, so only those lines need to be tried.
+    """
+
+    def __init__(self, string):
+        # Memory-mapped files are indexed as bytes too
+        if not isinstance(string, str):
+            token = re.compile(br'^[^ \t\r\n]*', re.M)
+        else:
+            token = re.compile(r'^[^ \t\r\n]*', re.M)
+        self.offsets = {}
+        for match in token.finditer(string):
+            offsets = self.offsets.get(match.group())
+            if offsets is None:
+                offsets = self.offsets[match.group()] = array('Q')
+            offsets.append(match.start())
+        self.tokens = sorted(self.offsets)
+
+    def candidates(self, prefix, ignorecase=False):
+        """Returns the sorted offsets of the lines starting with a prefix."""
+        found = []
+        if ignorecase:
+            prefix = prefix.lower()
+            for token in self.tokens:
+                # Non-ASCII characters may match ASCII ones in a case
+                # insensitive pattern (e.g. KELVIN SIGN), always try them
+                if (token[:len(prefix)].lower() == prefix or
+                        not token.isascii()):
+                    found.append(self.offsets[token])
+        else:
+            i = bisect_left(self.tokens, prefix)
+            while i < len(self.tokens) and self.tokens[i].startswith(prefix):
+                found.append(self.offsets[self.tokens[i]])
+                i += 1
+        if len(found) == 1:
+            return found[0]
+        return sorted(offset for offsets in found for offset in offsets)
+
+
+class DirlistIndex(object):
+    """Offsets of the directory sections of a "ls -Ral /" listing.
+
+    A section starts with the "/path:" header of a directory and ends at the
+    first empty line after it. The index is built in a single pass and can
+    be saved next to the listing to be reused by later runs.
+    """
+
+    def __init__(self, filename, stat, persist=False):
+        self.filename = filename
+        self.sections = {}
+        signature = [stat.st_mtime_ns, stat.st_size]
+        try:
+            with open(filename + '.idx', 'r') as f:
+                saved = json.load(f)
+            if saved['signature'] == signature:
+                self.sections = saved['sections']
+                return
+        except (IOError, ValueError, KeyError):
+            pass
+
+        with open(filename, 'rb') as f:
+            headers = []
+            offset = 0
+            for line in f:
+                line_end = offset + len(line)
+                line = line.rstrip(b'\r\n')
+                if not line:
+                    self.close(headers, offset)
+                elif line.startswith(b'/') and line.endswith(b':'):
+                    path = line[:-1].decode('utf-8', 'surrogateescape')
+                    if path not in self.sections:
+                        headers.append((path, offset))
+                offset = line_end
+            self.close(headers, offset)
+
+        if persist:
+            with open(filename + '.idx', 'w') as f:
+                json.dump({
+                    'signature': signature,
+                    'sections': self.sections
+                }, f)
+
+    def close(self, headers, offset):
+        """Ends the sections of the headers seen since the last empty line."""
+        for path, start in headers:
+            self.sections.setdefault(path, (start, offset))
+        del headers[:]
+
+    def section(self, path):
+        """Returns the section of a directory, empty if it is not listed."""
+        if path not in self.sections:
+            return b''
+        start, end = self.sections[path]
+        with open(self.filename, 'rb') as f:
+            f.seek(start)
+            return f.read(end - start)
+
+
+class RegistryIndex(object):
+    """Values of a "reg export" file indexed by hive, key and value name.
+
+    The export is parsed in a single pass, the data of every value is
+    decoded to its type: integers for REG_DWORD and REG_QWORD, strings for
+    REG_SZ and REG_EXPAND_SZ, lists of strings for REG_MULTI_SZ and bytes
+    for anything else. Names are looked up case-insensitively like in the
+    registry itself.
+    """
+
+    def __init__(self, text):
+        self.hives = {}
+        values = None
+        lines = iter(text.splitlines())
+        for line in lines:
+            line = line.strip()
+            if line.startswith('['):
+                values = None
+                # Deleted keys ("[-HKEY_...]") are left out
+                if line.endswith(']') and not line.startswith('[-'):
+                    hive, _, path = line[1:-1].partition('\\')
+                    keys = self.hives.setdefault(hive.upper(), {})
+                    values = keys.setdefault(path.lower(), {})
+                continue
+            match = REGISTRY_VALUE.match(line)
+            if values is None or match is None:
+                continue
+            name, default, data = match.groups()
+            # Long hex data goes on over lines ending with a backslash
+            while data.startswith('hex') and data.endswith('\\'):
+                data = data[:-1] + next(lines, '').strip()
+            value = parse_registry_data(data)
+            if value is not None:
+                name = '@' if default else re.sub(r'\\(.)', r'\1', name)
+                values[name.lower()] = value
+
+    def lookup(self, path):
+        """Returns the (type, data) of a value, None if it is not exported.
+
+        The path is the key path followed by the value name, "@" names the
+        default value. A path naming a key returns (None, None).
+        """
+        hive, _, path = path.partition('\\')
+        keys = self.hives.get(HIVES.get(hive.upper(), hive.upper()), {})
+        key, _, name = path.lower().rpartition('\\')
+        values = keys.get(key)
+        if values is not None and name in values:
+            return values[name]
+        if path.lower() in keys:
+            return None, None
+        return None
+
+
+class ConfigIndex(object):
+    """Settings of a configuration file indexed by key.
+
+    The file is parsed once according to its syntax:
+      - sshd: sshd_config, keywords are case-insensitive and the first value
+        wins like in sshd, settings of Match blocks are kept apart from the
+        global ones and looked up as "Match <criteria>|<keyword>".
+      - sysctl: sysctl.conf, "key = value" lines where the last value wins,
+        "/" and "." separate the parts of a key alike.
+      - pam: files of /etc/pam.d, looked up as "<type> <module>" for the
+        control and arguments of the first line of a module, or as
+        "<type> <module> <argument>" for the value of one of its arguments.
+      - keyvalue: login.defs and other "KEY value" or "KEY=value" files,
+        the last value wins.
+    """
+
+    def __init__(self, text, syntax):
+        self.syntax = syntax
+        self.settings = {}
+        self.blocks = {}
+        getattr(self, 'parse_' + syntax)(text.splitlines())
+
+    def parse_sshd(self, lines):
+        """Parses sshd_config, where the first value of a keyword wins."""
+        settings = self.settings
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            match = CONFIG_LINE.match(line)
+            if match is None:
+                continue
+            keyword, value = match.group(1).lower(), match.group(2)
+            if keyword == 'match':
+                settings = self.blocks.setdefault(value.lower(), {})
+                continue
+            settings.setdefault(keyword, value)
+
+    def parse_sysctl(self, lines):
+        """Parses sysctl.conf, where the last value of a key wins."""
+        for line in lines:
+            line = line.strip()
+            if not line or line[0] in '#;':
+                continue
+            key, equals, value = line.partition('=')
+            if equals:
+                key = key.strip().lstrip('-').replace('/', '.')
+                self.settings[key] = value.strip()
+
+    def parse_pam(self, lines):
+        """Parses a PAM configuration, where the first line of a module wins."""
+        text = '\n'.join(lines).replace('\\\n', ' ')
+        for line in text.splitlines():
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            tokens = re.findall(r'\[[^\]]*\]|\S+', line)
+            if len(tokens) < 3:
+                continue
+            kind = tokens[0].lstrip('-').lower()
+            module = os.path.basename(tokens[2])
+            self.settings.setdefault('{} {}'.format(kind, module),
+                                     ' '.join([tokens[1]] + tokens[3:]))
+            for argument in tokens[3:]:
+                name, _, value = argument.partition('=')
+                self.settings.setdefault(
+                    '{} {} {}'.format(kind, module, name), value)
+
+    def parse_keyvalue(self, lines):
+        """Parses "KEY value" lines, where the last value of a key wins."""
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            match = CONFIG_LINE.match(line)
+            if match is not None:
+                self.settings[match.group(1)] = match.group(2)
+
+    def lookup(self, key):
+        """Returns the value of a setting, None if it is not set."""
+        key = key.strip()
+        if self.syntax == 'sshd':
+            if key.lower().startswith('match '):
+                criteria, _, keyword = key[6:].rpartition('|')
+                block = self.blocks.get(criteria.strip().lower(), {})
+                return block.get(keyword.strip().lower())
+            return self.settings.get(key.lower())
+        if self.syntax == 'sysctl':
+            return self.settings.get(key.replace('/', '.'))
+        if self.syntax == 'pam':
+            kind, _, rest = key.partition(' ')
+            return self.settings.get('{} {}'.format(kind.lower(), rest.strip()))
+        return self.settings.get(key)
+
+
+class Profile(object):
+    """Time, bytes and regex calls spent on the files and checks of an audit.
 
-    start_time = time.time()
+    Every file records its wall time, the CPU time of the thread auditing it
+    and the bytes scanned, and the calls, wall and CPU time spent on each of
+    its checks: regex calls of a pattern, lookups, queries and commands. The
+    single pass searching several patterns at once is only counted for the
+    file. Python regexes do not expose backtracking steps, so calls are the
+    closest measure of regex work available.
+    """
+
+    def __init__(self, host):
+        self.host = host
+        self.files = OrderedDict()
+        self.lock = Lock()
+
+    def file(self, filename):
+        """Returns the record of a file, creating it on first use."""
+        with self.lock:
+            record = self.files.get(filename)
+            if record is None:
+                record = self.files[filename] = {
+                    'file': filename,
+                    'wall': 0.0,
+                    'cpu': 0.0,
+                    'bytes': 0,
+                    'calls': {},
+                    'checks': [],
+                }
+            return record
+
+    def merge(self, files):
+        """Adds the records of files audited elsewhere, e.g. by a worker."""
+        for filename, other in files.items():
+            record = self.file(filename)
+            for name in ('wall', 'cpu', 'bytes'):
+                record[name] += other[name]
+            for key, stats in other['calls'].items():
+                total = record['calls'].setdefault(key, [0, 0.0, 0.0])
+                for i, value in enumerate(stats):
+                    total[i] += value
+            record['checks'].extend(other['checks'])
+
+    def checks(self):
+        """Returns the record of every check of every file."""
+        found = []
+        for record in self.files.values():
+            for number, key in record['checks']:
+                calls, wall, cpu = record['calls'].get(key, (0, 0.0, 0.0))
+                found.append({
+                    'file': record['file'],
+                    'chapter': number,
+                    'check': key,
+                    'calls': calls,
+                    'wall': wall,
+                    'cpu': cpu,
+                })
+        return found
+
+    def report(self, top):
+        """Prints the slowest files and checks."""
+        files = sorted(self.files.values(), key=lambda x: -x['wall'])[:top]
+        print_info('  Slowest files:')
+        for record in files:
+            print_verbose('    {:9.6f}s wall {:9.6f}s CPU {:>12d} bytes  {}'.format(
+                record['wall'], record['cpu'], record['bytes'],
+                re.sub('{', '{{', record['file'])))
+        checks = sorted(self.checks(), key=lambda x: -x['wall'])[:top]
+        print_info('  Slowest checks:')
+        for record in checks:
+            print_verbose('    {:9.6f}s wall {:9.6f}s CPU {:>6d} calls  {} {}'.format(
+                record['wall'], record['cpu'], record['calls'],
+                re.sub('{', '{{', record['chapter']),
+                re.sub('{', '{{', record['file'])))
+
+    def save(self, filename):
+        """Saves the profile as JSON."""
+        with open(filename, 'w') as f:
+            json.dump({
+                'host': self.host,
+                'files': [dict((name, value) for name, value in record.items()
+                               if name not in ('calls', 'checks'))
+                          for record in self.files.values()],
+                'checks': self.checks(),
+            }, f, indent=2)
+
+
+class ProfiledPattern(object):
+    """Compiled pattern recording the calls and time spent matching it."""
+
+    def __init__(self, regex, stats):
+        self.regex = regex
+        self.stats = stats
+
+    def search(self, *args):
+        return self.call(self.regex.search, args)
+
+    def match(self, *args):
+        return self.call(self.regex.match, args)
+
+    def call(self, method, args):
+        """Runs a method of the pattern, adding its cost to the stats."""
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            return method(*args)
+        finally:
+            add_cost(self.stats, wall, cpu)
+
+    def __getattr__(self, name):
+        return getattr(self.regex, name)
+
+
+class ResultCache(object):
+    """On-disk cache of the results of the files of hosts.
+
+    Entries are named after their content-addressed keys and hold the rows
+    as JSON, so a shared cache directory never has code loaded from it.
+    Reading an entry touches it, and once the cache grows over its size
+    limit the least recently used entries are removed.
+    """
+
+    def __init__(self, directory, limit):
+        self.directory = directory
+        self.limit = limit
+        os.makedirs(directory, exist_ok=True)
+        self.size = sum(entry.stat().st_size for entry in self.entries())
+
+    def entries(self):
+        """Lists the entries stored in the cache directory."""
+        return [entry for entry in os.scandir(self.directory)
+                if entry.name.endswith('.json')]
+
+    def get(self, key):
+        """Returns the cached results of a key, None if there are none.
+
+        Damaged entries, or entries not holding rows of 7 strings, are
+        missed like absent ones.
+        """
+        filename = os.path.join(self.directory, key + '.json')
+        try:
+            with open(filename, 'r', encoding='utf-8') as f:
+                rows = [tuple(row) for row in json.load(f)]
+            os.utime(filename)
+        except (IOError, ValueError, TypeError):
+            return None
+        for row in rows:
+            if len(row) != 7 or not all(isinstance(value, str) for value in row):
+                return None
+        return rows
+
+    def put(self, key, rows):
+        """Stores the results of a key, evicting old entries if needed."""
+        filename = os.path.join(self.directory, key + '.json')
+        temp = '{}.{}.tmp'.format(filename, os.getpid())
+        with open(temp, 'w', encoding='utf-8') as f:
+            json.dump(rows, f)
+        os.replace(temp, filename)
+        self.size += os.path.getsize(filename)
+        if self.size > self.limit:
+            self.evict()
+
+    def evict(self):
+        """Removes the least recently used entries down to 90% of the limit."""
+        entries = []
+        for entry in self.entries():
+            try:
+                stat = entry.stat()
+            except IOError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+        self.size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self.size <= self.limit * 0.9:
+                break
+            try:
+                os.remove(path)
+            except IOError:
+                pass
+            self.size -= size
+
+
+class AuditState(object):
+    """Results of the previous run of an incremental audit.
+
+    The state records the signature (mtime, size and hash) of every file
+    checked and the results of the benchmark rows checked on it. Only the
+    rows of changed files and new or changed rows need to be checked again,
+    the results of the others are taken over.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.options = (__version__, args.ignorecase, args.windows, args.linux,
+                        args.database)
+        self.hosts = {}
+        try:
+            with open(filename, 'rb') as f:
+                options, hosts = pickle.load(f)
+            if options == self.options and isinstance(hosts, dict):
+                self.hosts = hosts
+        except UNPICKLING_ERRORS:
+            pass
+        self.files = {}
+
+    def plan(self, path, category, filepath, checks):
+        """Returns which checks of a file must run, None for commands."""
+        if category is None:
+            return None
+        fullpath = '/'.join([path, filepath])
+        previous = self.hosts.get(path, {}).get(fullpath, {})
+        self.files.setdefault(path, {})
+        signature = self.signature(fullpath, previous.get('signature'))
+        rows = {}
+        if signature is not None and previous.get('signature') == signature:
+            rows = previous['rows']
+        keys = [repr((category, check)) for check in checks]
+        todo = [check for check, key in zip(checks, keys) if key not in rows]
+        return AuditPlan(path, fullpath, signature, keys, rows, todo)
+
+    def signature(self, filename, previous):
+        """Returns the signature of a file, hashing it only if it was touched."""
+        try:
+            stat = os.stat(source_file(filename))
+        except IOError:
+            return None
+        if previous is not None and previous[:2] == (stat.st_mtime_ns,
+                                                     stat.st_size):
+            return previous
+        digest = hashlib.sha256()
+        with open(source_file(filename), 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        signature = (stat.st_mtime_ns, stat.st_size, digest.hexdigest())
+        # A file touched without changes keeps its results
+        if previous is not None and previous[2] == signature[2]:
+            return previous[:2] + signature[2:]
+        return signature
+
+    def record(self, plan, unit_results, results):
+        """Adds the taken over and the new results of a file in CSV order."""
+        if len(unit_results) != len(plan.todo):
+            results.merge(unit_results)
+            return
+        new = iter(unit_results)
+        rows = {}
+        for key in plan.keys:
+            row = plan.rows.get(key) or next(new)
+            results.add(*row)
+            rows[key] = row
+        # Transient results are checked again by the next run
+        if plan.signature is not None and not unit_results.transient:
+            # Each category of a file has its own rows
+            entry = self.files[plan.path].setdefault(plan.fullpath, {
+                'signature': plan.signature,
+                'rows': {}
+            })
+            entry['rows'].update(rows)
+
+    def save(self):
+        """Saves the state, replacing the hosts audited in this run."""
+        self.hosts.update(self.files)
+        temp = '{}.{}.tmp'.format(self.filename, os.getpid())
+        with open(temp, 'wb') as f:
+            pickle.dump((self.options, self.hosts), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp, self.filename)
+
+
+class Auditor(object):
+    """Audits host snapshots against a benchmark.
+
+    An auditor is built once from a benchmark section of benchit.ini (the
+    "csv" file of the checks and the "benchmark" title) and the options, and
+    audits any number of hosts. Options, caches and output belong to the
+    auditor, so several auditors can run in one process, even in different
+    threads. The output is discarded unless a stream is given. Without
+    options, hosts are audited as the platform of the module the benchmark
+    section belongs to, unless another platform is given.
+
+        auditor = Auditor(config['Linux']['RedHat'], ignorecase=True)
+        results = auditor.audit_path('hosts/web01')
+    """
+
+    def __init__(self, benchmark, options=None, output=None, **overrides):
+        platform = overrides.pop('platform', None)
+        if options is None:
+            platform = platform or benchmark_platform(benchmark)
+            if platform is None:
+                raise ValueError('platform of the benchmark unknown')
+            if platform not in PLATFORMS:
+                raise ValueError('unknown platform {}'.format(platform))
+            options = parse_args(['-' + platform[0]])
+        elif platform is not None:
+            options = self.platform_options(platform, options)
+        options = copy.copy(options)
+        for name, value in overrides.items():
+            setattr(options, name, value)
+        self.benchmark = benchmark
+        self.options = options
+        self.output = NullOutput() if output is None else output
+        self.cache = None
+        if options.cache:
+            self.cache = ResultCache(options.cache, options.cachesize << 20)
+        self.executor = None
+        self.items = None
+        if benchmark is not None:
+            with self.activate():
+                self.items = load_items(benchmark['csv'])
+
+    def platform_options(self, platform, options=None):
+        """Returns the options of the auditor set to audit a platform."""
+        if options is None:
+            options = self.options
+        if platform is None:
+            return options
+        if platform not in PLATFORMS:
+            raise ValueError('unknown platform {}'.format(platform))
+        options = copy.copy(options)
+        for name in PLATFORMS:
+            setattr(options, name, name == platform)
+        return options
+
+    @contextmanager
+    def activate(self, options=None, output=None, profile=None):
+        """Makes the module functions of this thread work for the auditor."""
+        previous = (context.auditor, context.options, context.output,
+                    context.profile)
+        context.auditor = self
+        context.options = self.options if options is None else options
+        context.output = self.output if output is None else output
+        context.profile = profile
+        try:
+            yield self
+        finally:
+            (context.auditor, context.options, context.output,
+             context.profile) = previous
+
+    def audit_path(self, path, platform=None, state=None, sink=None):
+        """Audits a host snapshot and returns its AuditResult.
+
+        Results are forwarded to the sink instead of kept in memory if one
+        is given, e.g. a ResultSpool.
+        """
+        return self.collect(self.queue(path, platform, state), sink)
+
+    def queue(self, path, platform=None, state=None, pool=None):
+        """Plans the audit of a host, starting its work units in a pool.
+
+        Hosts are queued up front and collected later to keep the pool busy.
+        """
+        options = self.platform_options(platform)
+        units = []
+        profile = Profile(path) if options.profile else None
+        with self.activate(options, profile=profile):
+            for unit in work_units(path, self.items):
+                plan = None
+                if state is not None:
+                    plan = state.plan(*unit)
+                    if plan is not None:
+                        unit = unit[:3] + (plan.todo,)
+                future = None
+                if pool is not None and unit[3]:
+                    future = pool.submit(audit_unit_isolated, options, unit)
+                units.append((unit, plan, future))
+        return AuditJob(path, options, state, units, profile)
+
+    def collect(self, job, sink=None):
+        """Runs or collects the work units of a queued host audit."""
+        with self.activate(job.options, profile=job.profile):
+            start_time = time.time()
+            results = AuditResult(sink)
+
+            # Start the shell commands of the host early to run in the background
+            commands = {}
+            for i, (unit, plan, future) in enumerate(job.units):
+                if unit[1] is None and future is None:
+                    commands[i] = submit_commands(unit[0], unit[2], unit[3])
+
+            print_info('Audit in progress, this can take a while...')
+            category = NotImplemented
+            for i, (unit, plan, future) in enumerate(job.units):
+                if unit[1] != category:
+                    category = unit[1]
+                    print_info('  Checking items in category {}...', category)
+                unit_results = results if plan is None else AuditResult()
+                if not unit[3]:
+                    print_status('    Processing {}', unit[2])
+                    print_good('Unchanged!')
+                elif future is None:
+                    audit_unit(*unit, unit_results, commands.get(i))
+                else:
+                    # Merge in submission order, the same order a serial run has
+                    output, worker_results, files = future.result()
+                    print(output, end='', file=context.output)
+                    unit_results.merge(worker_results)
+                    if job.profile is not None:
+                        job.profile.merge(files)
+                if plan is not None:
+                    job.state.record(plan, unit_results, results)
+            print_info('Audit finished in {:f} seconds!',
+                       time.time() - start_time)
+            release_files(job.path)
+            if job.profile is not None:
+                job.profile.report(job.options.profile)
+        return results
+
+    def command_executor(self):
+        """Returns the thread pool running the shell commands of the auditor."""
+        with cache_lock:
+            if self.executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+                self.executor = ThreadPoolExecutor(self.options.commandjobs)
+        return self.executor
+
+
+def benchmark_platform(benchmark):
+    """Returns the platform of a benchmark section of benchit.ini, if known."""
+    module = getattr(benchmark, 'parent', None)
+    return MODULES.get(getattr(module, 'name', None))
+
+
+AuditPlan = namedtuple('AuditPlan', 'path fullpath signature keys rows todo')
+AuditJob = namedtuple('AuditJob', 'path options state units profile')
+PatternInfo = namedtuple('PatternInfo',
+                         'prefix line_local combinable backtracking')
+
+
+def parse_args(argv=None):
+    """Parses the command line options."""
+    from argparse import ArgumentParser
+    from argparse import RawDescriptionHelpFormatter
+
+    parser = ArgumentParser(
+        formatter_class=RawDescriptionHelpFormatter,
+        description=__doc__,
+        prog='benchit'
+    )
+
+    module = parser.add_mutually_exclusive_group(required=True)
+    module.add_argument('-d, --database', dest='database', action='store_true',
+                        help='audit Oracle database')
+    module.add_argument('-l, --linux', dest='linux', action='store_true',
+                        help='audit Linux system')
+    module.add_argument('-w, --windows', dest='windows', action='store_true',
+                        help='audit Windows system')
+
+    parser.add_argument('-o, --output', dest='output', default='results',
+                        help='output filename (default results_{timestamp}.html)')
+    parser.add_argument('-p, --path', dest='path', default='.',
+                        help='base path to target directory (default .)')
+    parser.add_argument('-b, --batch', dest='batch', metavar='B',
+                        help='audit every host snapshot in directory or manifest B')
+    parser.add_argument('--jobs', dest='jobs', type=int, default=1, metavar='N',
+                        help='audit files and hosts in N processes (default 1)')
+    parser.add_argument('--command-jobs', dest='commandjobs', type=int, default=4,
+                        metavar='N', help='run N shell commands at once (default 4)')
+    parser.add_argument('--command-timeout', dest='commandtimeout', type=float,
+                        metavar='S', help='stop shell commands after S seconds')
+    parser.add_argument('--regex-timeout', dest='regextimeout', type=float,
+                        default=10, metavar='S',
+                        help='stop patterns prone to backtracking after S seconds '
+                             '(default 10)')
+    parser.add_argument('--stream', dest='stream', type=int, metavar='MB',
+                        help='search files larger than MB megabytes line by line')
+    parser.add_argument('-v, --verbose', dest='verbose', action='store_true',
+                        help='run in verbose mode')
+    parser.add_argument('-s, --skip-dirlist', dest='skipdirlist', action='store_true',
+                        help='skip directory list checking (default false)')
+    parser.add_argument('--cache', dest='cache', metavar='DIR',
+                        help='reuse results of unchanged files cached in DIR')
+    parser.add_argument('--cache-size', dest='cachesize', type=int, default=256,
+                        metavar='MB', help='size limit of the cache (default 256)')
+    parser.add_argument('--incremental', dest='incremental', metavar='STATE',
+                        help='check only changed files and rows, state in STATE')
+    parser.add_argument('--save-index', dest='saveindex', action='store_true',
+                        help='save directory list indexes next to dirlist.txt')
+    parser.add_argument('--compile', dest='compile', action='store_true',
+                        help='validate and compile the benchmarks of the module')
+    parser.add_argument('--profile', dest='profile', type=int, nargs='?',
+                        const=10, metavar='N',
+                        help='profile files and checks, show the N slowest')
+    parser.add_argument('--debug', dest='debug', action='store_true',
+                        help='run in debug mode (default false)')
+    parser.add_argument('--no-color', dest='nocolor', action='store_true',
+                        help='disable colored output (default false)')
+    parser.add_argument('-i, --ignore-case', dest='ignorecase', action='store_true',
+                        help='perform case-insensitive matching (default false)')
+
+    return parser.parse_args(argv)
+
+
+def configure(options):
+    """Applies the parsed options, also in every pool worker process."""
+    global WHITE, GREY, RED, GREEN, BLUE
+    context.options = options
+    if options.nocolor:
+        WHITE = GREY = RED = GREEN = BLUE = ''
+
+
+def main():
+    from configobj import ConfigObj
 
     config = ConfigObj('benchit.ini')
 
+    if args.compile:
+        exit(0 if compile_benchmarks(config) else 1)
+
+    if args.batch:
+        hosts = load_hosts(args.batch)
+        print_info('Batch audit of {} hosts...', len(hosts))
+    else:
+        hosts = [args.path]
+
+    pool = None
+    if args.jobs > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        # Workers spawned instead of forked start without the options
+        pool = ProcessPoolExecutor(max_workers=args.jobs, initializer=configure,
+                                   initargs=(context.options,))
+
+    state = None
+    if args.incremental:
+        state = AuditState(args.incremental)
+
+    # Queue the work units of every host up front to keep the pool busy
+    auditors = {}
+    queue = []
+    # The fleet summary lists the hosts in input order, skipped ones too
+    summary = [(path, 'N/A', 0, 0, 0, 0) for path in hosts]
+    for i, (path, name) in enumerate(zip(hosts, host_names(hosts))):
+        audit = detect_audit(config, path)
+        if audit is None:
+            print_warning('Nothing to audit...')
+            if not args.batch:
+                exit(1)
+            continue
+        if audit['csv'] not in auditors:
+            auditors[audit['csv']] = Auditor(audit, context.options, sys.stdout)
+        auditor = auditors[audit['csv']]
+        queue.append((i, name, auditor,
+                      auditor.queue(path, state=state, pool=pool)))
+
+    for i, name, auditor, job in queue:
+        if args.batch:
+            print_info('Auditing {}...', job.path)
+
+        # Results go to disk as files finish, the reports read them sorted
+        spool = ResultSpool()
+        results = auditor.collect(job, spool)
+
+        timestamp = time.strftime("%Y%m%dT%H%M%S")
+        if args.batch:
+            filename = '{}_{}_{}'.format(args.output, name, timestamp)
+        else:
+            filename = '{}_{}'.format(args.output, timestamp)
+        create_html_report('{}.html'.format(filename), results,
+                           auditor.benchmark['benchmark'])
+        create_csv_report('{}.csv'.format(filename), results)
+        if job.profile is not None:
+            job.profile.save('{}_profile.json'.format(filename))
+        spool.close()
+        summary[i] = (job.path, auditor.benchmark['benchmark'], results.total,
+                      results.passed, results.failed, results.errors)
+
+    if pool is not None:
+        pool.shutdown()
+
+    if state is not None:
+        state.save()
+
+    if args.debug:
+        print_verbose('Pattern cache: {} compiled, {} hits, {} misses'.format(
+            len(patterns), patterns.hits, patterns.misses))
+
+    if args.batch:
+        timestamp = time.strftime("%Y%m%dT%H%M%S")
+        create_summary_report('{}_fleet_{}.csv'.format(args.output, timestamp),
+                              summary)
+
+
+def load_hosts(batch):
+    """Lists host snapshots from a directory or from a manifest file."""
+    if os.path.isdir(batch):
+        return sorted(
+            os.path.join(batch, name) for name in os.listdir(batch)
+            if os.path.isdir(os.path.join(batch, name))
+        )
+    with open(batch, mode='r') as infile:
+        return [
+            line.strip() for line in infile
+            if line.strip() and not line.startswith('#')
+        ]
+
+
+def host_names(hosts):
+    """Returns a unique filename-friendly name of every host snapshot.
+
+    Hosts are named after their path relative to the directory all of them
+    are in, e.g. "web01_latest" for "/snap/web01/latest". A number is
+    appended to names which are taken already.
+    """
+    paths = [os.path.abspath(path) for path in hosts]
+    root = os.path.commonpath(paths) if paths else ''
+    names = []
+    for path in paths:
+        if path == root:
+            name = os.path.basename(path)
+        else:
+            name = os.path.relpath(path, root).replace(os.sep, '_')
+        unique = name
+        number = 1
+        while unique in names:
+            number += 1
+            unique = '{}_{}'.format(name, number)
+        names.append(unique)
+    return names
+
+
+def compile_benchmarks(config):
+    """Compiles every benchmark of the selected module found on disk."""
+    if args.database:
+        sections = config['Database']
+    elif args.windows:
+        sections = config['Windows']
+    else:
+        sections = config['Linux']
+    compiled = True
+    for section in sections.values():
+        filename = section['csv']
+        if not os.path.isfile(filename):
+            if args.verbose:
+                print_verbose('Benchmark {} not found, skipping', filename)
+            continue
+        print_status('Compiling {}', filename)
+        if compile_benchmark(filename):
+            print_good('Done!')
+        else:
+            print_error('Failed!')
+            compiled = False
+    return compiled
+
+
+def detect_audit(config, path):
+    """Returns the benchmark section of the configuration matching a host."""
     if args.database:
         print_info('Oracle detected!')
-        audit = config['Database']['Oracle']
+        return config['Database']['Oracle']
     elif args.windows:
         print_info('Windows detected!')
-        audit = config['Windows']['2012']
+        return config['Windows']['2012']
     elif args.linux:
         for distro in ['CentOS', 'RedHat', 'SuSe', 'LSB', 'Debian']:
-            if os.path.isfile('{}/etc/{}-release'.format(args.path, distro)):
+            if os.path.isfile('{}/etc/{}-release'.format(path, distro)):
                 print_info('{} Linux detected!', distro)
-                audit = config['Linux'][distro]
-                break
+                return config['Linux'][distro]
+    return None
+
+
+def load_items(filename):
+    """Loads the checks of a benchmark CSV file, parsing each version once.
+
+    A compiled benchmark next to the CSV file is loaded instead, as long as
+    it was compiled from the same version of the CSV file.
+    """
+    stat = os.stat(filename)
+    key = (filename, stat.st_mtime_ns, stat.st_size)
+    return cached(benchmarks, key, BENCHMARK_CACHE,
+                  lambda: read_items(filename))
 
-    if audit is None:
-        print_warning('Nothing to audit...')
-        exit(1)
 
-    with open(audit['csv'], mode='r') as infile:
+def read_items(filename):
+    """Reads the checks of a benchmark, see load_items()."""
+    items = load_compiled(filename)
+    if items is None:
+        items = parse_benchmark(filename)
+        # Compile every pattern once, the same objects serve all files and hosts
+        if not args.database:
+            for category, records in items.items():
+                if category is None:
+                    continue
+                for checks in records.values():
+                    for check in checks:
+                        if is_lookup(check[0]):
+                            continue
+                        if is_backtracking(compile_check(check[0])):
+                            print_warning('{}', '{}: {} {}'.format(
+                                filename, check[1], BACKTRACKING_WARNING))
+
+    # Chapters are ordered by the same keys in every report of the run
+    for records in items.values():
+        for checks in records.values():
+            for check in checks:
+                chapter_key(check[1])
+    return items
+
+
+def parse_benchmark(filename):
+    """Parses a benchmark CSV file into checks grouped by category and file."""
+    import csv
+    items = {}
+    categories = {}
+    with open(filename, mode='r') as infile:
         reader = csv.reader(infile, delimiter=';')
         for row in reader:
-            i = row[0]
+            if not row:
+                continue
+            if row[0] not in categories:
+                categories[row[0]] = ast.literal_eval(row[0])
+            i = categories[row[0]]
             n = row[1]
             if i in items:
                 if n in items[i]:
@@ -163,187 +1497,536 @@ def main():
                     items[i][n] = [tuple(row[2:])]
             else:
                 items[i] = {row[1]: [tuple(row[2:])]}
+    return items
+
+
+def compile_benchmark(filename):
+    """Validates a benchmark CSV file and saves it compiled for fast loading.
+
+    The compiled benchmark holds a version header, the signature of the CSV
+    file, the grouped checks and the analysis of every pattern.
+    """
+    import csv
+    problems = []
+    warnings = []
+    infos = {}
+    with open(filename, mode='r') as infile:
+        for line, row in enumerate(csv.reader(infile, delimiter=';'), 1):
+            if not row:
+                continue
+            try:
+                category = ast.literal_eval(row[0])
+            except (ValueError, SyntaxError):
+                category = row[0]
+            if category not in (True, False, None):
+                problems.append((line, 'invalid category {}'.format(row[0])))
+            elif category is None and len(row) < 6:
+                problems.append((line, 'expected at least 6 columns'))
+            elif category is not None and len(row) != 8:
+                problems.append((line, 'expected 8 columns'))
+            elif category is not None and row[2].startswith(CONF_PREFIX):
+                if not row[2][len(CONF_PREFIX):].strip():
+                    problems.append((line, 'missing configuration key'))
+            elif category is not None and is_lookup(row[2]):
+                hive = row[2][len(KEY_PREFIX):].partition('\\')[0].upper()
+                if hive not in HIVES and hive not in HIVES.values():
+                    problems.append((line, 'unknown hive {}'.format(hive)))
+            elif category is not None and not args.database:
+                try:
+                    for binary in (True, False):
+                        regex = compile_check(row[2], binary)
+                        infos[(regex.pattern, regex.flags)] = \
+                            tuple(pattern_info(regex))
+                    if is_backtracking(regex):
+                        warnings.append((line, BACKTRACKING_WARNING))
+                except re.error as err:
+                    problems.append((line, 'invalid pattern ({})'.format(err)))
+    for line, warning in warnings:
+        print_warning('{}', '{}:{}: {}'.format(filename, line, warning))
+    if problems:
+        for line, problem in problems:
+            print_warning('{}', '{}:{}: {}'.format(filename, line, problem))
+        return False
 
-    print_info('Audit in progress, this can take a while...')
+    stat = os.stat(filename)
+    compiled = {
+        'source': (stat.st_size, stat.st_mtime_ns),
+        'items': parse_benchmark(filename),
+        'patterns': infos,
+    }
+    with open(filename + 'c', 'wb') as f:
+        f.write(BENCHMARK_HEADER)
+        pickle.dump(compiled, f, pickle.HIGHEST_PROTOCOL)
+    return True
 
+
+def load_compiled(filename):
+    """Loads a compiled benchmark, None if there is no up to date one."""
+    try:
+        with open(filename + 'c', 'rb') as f:
+            if f.readline() != BENCHMARK_HEADER:
+                return None
+            compiled = pickle.load(f)
+        source, items = compiled['source'], compiled['items']
+        infos = {key: PatternInfo(*info)
+                 for key, info in compiled['patterns'].items()}
+    except UNPICKLING_ERRORS:
+        return None
+    try:
+        stat = os.stat(filename)
+        if source != (stat.st_size, stat.st_mtime_ns):
+            return None
+    except IOError:
+        pass
+    for key, info in infos.items():
+        pattern_infos.setdefault(key, info)
+    return items
+
+
+def work_units(path, items):
+    """Splits the audit of a host into (host, category, file) work units."""
     for category, records in items.items():
-        print_info('  Checking items in category {}...', category)
-        category = ast.literal_eval(category)
         for filepath, checks in records.items():
-            fullpath = '/'.join([args.path, filepath])
-            check_item_preprocess(fullpath)
-            if category is not None:
+            yield path, category, filepath, checks
+
+
+def profile_stats(filename, key):
+    """Returns the [calls, wall, CPU] stats of a check of a file.
+
+    Returns None unless the audit is profiled.
+    """
+    if context.profile is None:
+        return None
+    return context.profile.file(filename)['calls'].setdefault(key, [0, 0.0, 0.0])
+
+
+def profile_bytes(filename, size):
+    """Adds the bytes scanned in a file to the profile of the audit."""
+    if context.profile is not None:
+        context.profile.file(filename)['bytes'] += size
+
+
+def profiled(regex, filename, key):
+    """Returns a pattern recording its cost when the audit is profiled."""
+    stats = profile_stats(filename, key)
+    if stats is None:
+        return regex
+    return ProfiledPattern(regex, stats)
+
+
+def timed(stats, function, *args):
+    """Calls a function, adding its cost to the stats if there are any."""
+    if stats is None:
+        return function(*args)
+    wall, cpu = time.perf_counter(), time.thread_time()
+    try:
+        return function(*args)
+    finally:
+        add_cost(stats, wall, cpu)
+
+
+def add_cost(stats, wall, cpu):
+    """Adds a call started at the given wall and CPU times to the stats."""
+    stats[0] += 1
+    stats[1] += time.perf_counter() - wall
+    stats[2] += time.thread_time() - cpu
+
+
+def audit_unit_isolated(options, unit):
+    """Runs a work unit in a pool worker and returns its output and results."""
+    global worker
+    # Each worker process audits for an auditor of its own
+    if worker is None:
+        worker = Auditor(None, options)
+    results = AuditResult()
+    output = io.StringIO()
+    profile = Profile(unit[0]) if options.profile else None
+    with worker.activate(options, output, profile):
+        audit_unit(*unit, results)
+    return output.getvalue(), results, profile and profile.files
+
+
+def audit_unit(path, category, filepath, checks, results, commands=None):
+    """Runs the checks of a single file collected from a host."""
+    fullpath = '/'.join([path, filepath])
+    if context.profile is None:
+        return run_unit(path, category, filepath, checks, results, commands)
+    record = context.profile.file(fullpath)
+    record['checks'].extend((check[1], check[0]) for check in checks)
+    wall, cpu = time.perf_counter(), time.thread_time()
+    try:
+        run_unit(path, category, filepath, checks, results, commands)
+    finally:
+        record['wall'] += time.perf_counter() - wall
+        record['cpu'] += time.thread_time() - cpu
+
+
+def run_unit(path, category, filepath, checks, results, commands=None):
+    """Runs the checks of a work unit, see audit_unit()."""
+    fullpath = '/'.join([path, filepath])
+    if category is not None:
+        print_status('    Processing {}', filepath)
+        if args.verbose:
+            print(file=context.output)
+        if args.database:
+            check_item_database(fullpath, checks, category, results)
+        elif args.linux or args.windows:
+            check_item_os(fullpath, checks, category, results)
+    else:
+        from subprocess import TimeoutExpired
+        if commands is None:
+            commands = submit_commands(path, filepath, checks)
+        # Results are collected in CSV order, whichever command ends first
+        for check, future in zip(checks, commands):
+            command, number, title, description, *_ = check
+            try:
                 print_status('    Processing {}', filepath)
                 if args.verbose:
-                    print()
-                if args.database:
-                    check_item_database(fullpath, checks, category)
-                elif args.linux or args.windows:
-                    check_item_os(fullpath, checks, category)
-            else:
-                for command, number, title, description, *_ in checks:
-                    try:
-                        total += 1
-                        print_status('    Processing {}', filepath)
-                        if not os.path.isfile('/'.join([args.path, filepath])):
-                            raise IOError()
-                        command = command.format(args.path)
-                        if args.verbose:
-                            print()
-                            print_verbose('    Executing {}', command)
-                        output = check_output(command, shell=True)
-                        if not args.verbose:
-                            print_good('OK!')
-                        if output:
-                            failed += 1
-                            result = 'Fail'
-                        else:
-                            passed += 1
-                            result = 'Pass'
-                    except (IOError, OSError) as e:
-                        print_error('Not found!')
-                        errors += 1
-                        result = 'Error'
-                    results.append((
-                        number,
-                        title,
-                        description,
-                        '',     # default
-                        'N/A',  # actual
-                        'N/A',  # expected
-                        result))
-
-    print_info('Audit finished in {:f} seconds!', time.time() - start_time)
-
-    timestamp = time.strftime("%Y%m%dT%H%M%S")
-    filename = '{}_{}'.format(args.output, timestamp)
-    create_html_report('{}.html'.format(filename))
-    create_csv_report('{}.csv'.format(filename))
-
-
-def check_item_preprocess(filepath):
-    # Convert UTF-16 encoded files (created by reg export) to UTF-8
-    if args.windows and '.reg' in filepath:
-        try:
-            with io.open(filepath, 'r', encoding='utf-16') as f:
-                text = f.read()
-            with io.open(filepath, 'w', encoding='utf-8') as f:
-                f.write(text)
-        except (UnicodeError, UnicodeDecodeError, IOError) as e:
-            pass
-    # Processing large directory content lists ("ls -Ral /") can be very slow.
-    # Copy out the necessary directory lists into smaller files.
-    if args.linux and 'dirlist-' in filepath and not os.path.isfile(filepath):
-        command = 'grep -P "^/{0}:[\s\S]*" -A500 {1} | sed -e "/^$/,$d" > {2}'
-        command = command.format(
-            filepath[filepath.index('-')+1:-4].replace('-', '/'),
-            filepath[:filepath.index('-'):] + '.txt',
-            filepath
-        )
-        check_call(command, shell=True)
+                    print(file=context.output)
+                    print_verbose('    Executing {}', command.format(path))
+                output = future.result()
+                if not args.verbose:
+                    print_good('OK!')
+                if output:
+                    result = 'Fail'
+                else:
+                    result = 'Pass'
+            except TimeoutExpired as e:
+                print_error('Timed out!')
+                result = 'Error'
+            except LookupError as e:
+                print_error('Unknown check!')
+                result = 'Error'
+            except (IOError, OSError) as e:
+                print_error('Not found!')
+                result = 'Error'
+            results.add(
+                number,
+                title,
+                description,
+                '',     # default
+                'N/A',  # actual
+                'N/A',  # expected
+                result)
+
+
+def submit_commands(path, filepath, checks):
+    """Starts the shell commands of a file in the background."""
+    executor = context.auditor.command_executor()
+    fullpath = '/'.join([path, filepath])
+    return [executor.submit(timed, profile_stats(fullpath, check[0]),
+                            run_command, path, filepath, check[0],
+                            args.commandtimeout)
+            for check in checks]
+
+
+def run_command(path, filepath, command, timeout=None):
+    """Runs a shell command check and returns its output."""
+    from subprocess import PIPE
+    from subprocess import Popen
+    from subprocess import TimeoutExpired
+    from subprocess import CalledProcessError
+    if not os.path.isfile('/'.join([path, filepath])):
+        raise IOError()
+    if command.startswith('@'):
+        return run_native_check(path, filepath, command[1:])
+    command = command.format(path)
+    # Run in a new session to stop the whole pipeline when it times out
+    process = Popen(command, shell=True, stdout=PIPE, start_new_session=True)
+    try:
+        output, _ = process.communicate(timeout=timeout)
+    except TimeoutExpired:
+        if hasattr(os, 'killpg'):
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+        process.communicate()
+        raise
+    if process.returncode:
+        raise CalledProcessError(process.returncode, command, output)
+    return output
+
+
+def run_native_check(path, filepath, name):
+    """Runs a built-in check instead of a shell command.
+
+    Rows name a built-in check as "@name" instead of a command, it gets the
+    file of the row and its output is handled like that of a command.
+    """
+    findings = native_checks[name]('/'.join([path, filepath]))
+    return '\n'.join(findings).encode('utf-8')
+
+
+def native_check(name):
+    """Registers a built-in check under the name rows refer to it."""
+    def register(function):
+        native_checks[name] = function
+        return function
+    return register
+
+
+@native_check('world_writable_files')
+def check_world_writable_files(filename):
+    """Lists regular files writable by anyone in a directory listing."""
+    return [path for mode, path in special_modes(filename)
+            if mode[0] == '-' and mode[8] == 'w']
+
+
+@native_check('world_writable_dirs')
+def check_world_writable_dirs(filename):
+    """Lists directories writable by anyone without the sticky bit."""
+    return [path for mode, path in special_modes(filename)
+            if mode[0] == 'd' and mode[8] == 'w' and mode[9] not in 'tT']
+
+
+@native_check('suid_files')
+def check_suid_files(filename):
+    """Lists files with the set-user-ID bit in a directory listing."""
+    return [path for mode, path in special_modes(filename)
+            if mode[0] == '-' and mode[3] in 'sS']
+
+
+@native_check('sgid_files')
+def check_sgid_files(filename):
+    """Lists files with the set-group-ID bit in a directory listing."""
+    return [path for mode, path in special_modes(filename)
+            if mode[0] == '-' and mode[6] in 'sS']
+
+
+@native_check('empty_passwords')
+def check_empty_passwords(filename):
+    """Lists accounts without a password in a shadow file."""
+    return [fields[0] for fields in colon_file(filename)
+            if len(fields) > 1 and fields[1] == '']
+
+
+@native_check('uid0_accounts')
+def check_uid0_accounts(filename):
+    """Lists accounts other than root with UID 0 in a passwd file."""
+    return [fields[0] for fields in colon_file(filename)
+            if len(fields) > 2 and fields[2] == '0' and fields[0] != 'root']
+
+
+@native_check('legacy_entries')
+def check_legacy_entries(filename):
+    """Lists legacy "+" NIS entries of a passwd, shadow or group file."""
+    return [fields[0] for fields in colon_file(filename)
+            if fields[0].startswith('+')]
+
+
+@native_check('duplicate_names')
+def check_duplicate_names(filename):
+    """Lists names used more than once in a passwd or group file."""
+    return find_duplicates(filename, 0)
+
+
+@native_check('duplicate_ids')
+def check_duplicate_ids(filename):
+    """Lists UIDs or GIDs used more than once in a passwd or group file."""
+    return find_duplicates(filename, 2)
+
+
+def find_duplicates(filename, field):
+    """Lists the values of a field shared by several entries of a file."""
+    entries = OrderedDict()
+    for fields in colon_file(filename):
+        if len(fields) > field:
+            entries.setdefault(fields[field], []).append(fields[0])
+    return ['{}: {}'.format(value, ' '.join(names))
+            for value, names in entries.items() if len(names) > 1]
+
+
+def colon_file(filename):
+    """Returns the fields of the entries of a passwd-like file, parsed once."""
+    def parse():
+        with open(filename, 'r', encoding='utf8') as f:
+            return [line.rstrip('\n').split(':') for line in f
+                    if line.strip() and not line.startswith('#')]
+    stat = os.stat(filename)
+    key = (filename, stat.st_mtime_ns, stat.st_size)
+    return cached(colon_files, key, COLON_FILE_CACHE, parse)
+
+
+def special_modes(filename):
+    """Returns (mode, path) of the entries of a "ls -Ral /" listing which are
+    writable by anyone or have the set-user-ID or set-group-ID bit set.
+
+    The listing is parsed only once, only these entries are kept.
+    """
+    def parse():
+        found = []
+        directory = ''
+        with open(filename, 'r', encoding='utf8', errors='replace') as f:
+            for line in f:
+                line = line.rstrip('\n')
+                if line.startswith('/') and line.endswith(':'):
+                    directory = line[:-1].rstrip('/')
+                    continue
+                fields = line.split(None, 8)
+                if len(fields) < 9 or len(fields[0]) < 10:
+                    continue
+                mode = fields[0]
+                if mode[8] == 'w' or mode[3] in 'sS' or mode[6] in 'sS':
+                    name = fields[8].split(' -> ')[0]
+                    if name not in ('.', '..'):
+                        found.append((mode, directory + '/' + name))
+        return found
+    stat = os.stat(filename)
+    key = (filename, stat.st_mtime_ns, stat.st_size)
+    return cached(special_files, key, COLON_FILE_CACHE, parse)
+
+
+def is_dirlist_view(filename):
+    """Checks if a file is a directory list to be served from dirlist.txt.
+
+    Processing large directory content lists ("ls -Ral /") can be very slow,
+    so dirlist-etc-ssh.txt stands for the section of /etc/ssh in dirlist.txt
+    unless such a file was collected too.
+    """
+    name = os.path.basename(filename)
+    return (args.linux and name.startswith('dirlist-') and
+            name.endswith('.txt') and not os.path.isfile(filename))
+
 
+def dirlist_view(filename):
+    """Returns the section of dirlist.txt a directory list view stands for."""
+    name = os.path.basename(filename)
+    path = '/' + name[len('dirlist-'):-len('.txt')].replace('-', '/')
+    return dirlist_index(source_file(filename)).section(path)
 
-def check_item_os(filename, items, category):
+
+def dirlist_index(filename):
+    """Returns the index of a directory listing, building it only once."""
+    stat = os.stat(filename)
+    key = (filename, stat.st_mtime_ns, stat.st_size)
+    return cached(dirlist_indexes, key, DIRLIST_INDEX_CACHE,
+                  lambda: DirlistIndex(filename, stat, args.saveindex))
+
+
+def cached(cache, key, limit, build):
+    """Returns an entry of a cache, building it if needed.
+
+    Only the last used entries are kept, up to the given limit.
+    """
+    with cache_lock:
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+    value = build()
+    with cache_lock:
+        cache[key] = value
+        if len(cache) > limit:
+            cache.popitem(last=False)
+    return value
+
+
+def source_file(filename):
+    """Returns the file on disk holding the contents of a file."""
+    if is_dirlist_view(filename):
+        return os.path.join(os.path.dirname(filename), 'dirlist.txt')
+    return filename
+
+
+def check_item_os(filename, items, category, results):
     """Checks every regex pattern listed in the loaded CSV file."""
-    global results, total, passed, failed, errors
     if args.linux and args.skipdirlist and ('dirlist.txt' in filename):
         return
+    result_cache = context.auditor.cache
     try:
-        with open(filename, 'r', encoding='utf8') as f:
-            string = f.read().replace('\\', '\\\\')
-            for pattern, number, title, summary, default, expected in items:
-                total += 1
-                flags = (re.M | re.I) if args.ignorecase else re.M
-                match = re.search(pattern, string, flags)
-                if len(expected) == 0:
-                    expected = 'N/A'
-                # We did not find anything to work with
-                if not match:
-                    match = 'N/F'
-                # We found a match and we are not interested in the details
-                elif len(match.groups()) == 0:
-                    match = 'N/A'
-                # We found a match and we have a subgroup to check
-                else:
-                    match = match.group(1)
-                # Convert null-terminated strings from HEX to ASCII
-                if args.windows and match.startswith('hex'):
-                    match = re.sub('(00,?|[\s,]|\\\\)', '', match[7:])
-                    match = binascii.unhexlify(match)
-                    match = str(match)[2:-1]
-                # We expect a match
-                if category is True:
-                    # We found a match
-                    if match != 'N/F':
-                        # Any value is accepted
-                        if expected == 'N/A':
-                            passed += 1
-                            result = 'Pass'
-                        # Check relational (>, <, =) values
-                        elif check_item_relational(match, expected):
-                            passed += 1
-                            result = 'Pass'
-                        else:
-                            failed += 1
-                            result = 'Fail'
-                    # We have a default value
-                    elif len(default) != 0 and check_item_default(default, expected):
-                            passed += 1
-                            result = 'Pass'
+        key = None
+        if result_cache is not None:
+            key = result_key(filename, items, category)
+            rows = result_cache.get(key)
+            if rows is not None:
+                for row in rows:
+                    results.add(*row)
+                    if args.verbose:
+                        print_check(*row)
+                if not args.verbose:
+                    print_good('OK!')
+                return
+        rows = []
+        matches = find_matches(filename, items)
+        for item, match in zip(items, matches):
+            pattern, number, title, summary, default, expected = item
+            if len(expected) == 0:
+                expected = 'N/A'
+            failure = None
+            if match is TIMED_OUT or match is SEARCH_FAILED:
+                failure, match = match, None
+            # We did not find anything to work with
+            if match is None:
+                match = 'N/F'
+            # We found a match and we are not interested in the details
+            elif len(match) == 0:
+                match = 'N/A'
+            # We looked up a setting, its value is decoded already
+            elif is_lookup(pattern):
+                match = match[0]
+            # We found a match and we have a subgroup to check
+            else:
+                match = check_value(match[0])
+            # Convert null-terminated strings from HEX to ASCII
+            if (args.windows and match.startswith('hex') and
+                    not is_lookup(pattern)):
+                import binascii
+                match = re.sub('(00,?|[\s,]|\\\\)', '', match[7:])
+                match = binascii.unhexlify(match)
+                match = str(match)[2:-1]
+            # We expect a match
+            if category is True:
+                # We found a match
+                if match != 'N/F':
+                    # Any value is accepted
+                    if expected == 'N/A':
+                        result = 'Pass'
+                    # Check relational (>, <, =) values
+                    elif check_item_relational(match, expected):
+                        result = 'Pass'
                     else:
-                        failed += 1
                         result = 'Fail'
-                # We don't expect a match
-                elif category is False and match == 'N/F':
-                    passed += 1
-                    result = 'Pass'
+                # We have a default value
+                elif len(default) != 0 and check_item_default(default, expected):
+                        result = 'Pass'
                 else:
-                    failed += 1
                     result = 'Fail'
-                results.append((
-                    number,
-                    title,
-                    summary,
-                    default,
-                    match,
-                    expected,
-                    result
-                ))
-                if args.verbose:
-                    print_verbose(
-                        '        '
-                        'N:{:15.15s}'
-                        'D:{:20.20s}'
-                        'M:{:20.20s}'
-                        'E:{:20.20s}'
-                        'R:{:5.5s}'.format(
-                            number,
-                            default,
-                            # Prevent { throwing an error in verbose mode
-                            re.sub('{', '{{', match),
-                            expected,
-                            result
-                        ))
-            if not args.verbose:
-                print_good('OK!')
+            # We don't expect a match
+            elif category is False and match == 'N/F':
+                result = 'Pass'
+            else:
+                result = 'Fail'
+            # The search did not finish, the reason is reported in place of a
+            # match and the results are never cached
+            if failure is TIMED_OUT:
+                match = 'Timed out after {:g}s'.format(args.regextimeout)
+            elif failure is SEARCH_FAILED:
+                match = 'Search failed'
+            if failure is not None:
+                result = 'Error'
+                key = None
+            row = (number, title, summary, default, match, expected, result)
+            results.add(*row, transient=failure is not None)
+            rows.append(row)
+            if args.verbose:
+                print_check(*row)
+        if key is not None:
+            result_cache.put(key, rows)
+        if not args.verbose:
+            print_good('OK!')
     except IOError as err:
-        if err.errno is 2:
+        if err.errno == 2:
             if not args.verbose:
                 print_error('Not found!')
             for pattern, number, title, summary, default, expected in items:
-                total += 1
                 match = 'N/F'
                 if len(default) != 0:
                     if check_item_default(default, expected):
-                        passed += 1
                         result = 'Pass'
                     else:
-                        failed += 1
                         result = 'Fail'
                 else:
-                    errors += 1
                     result = 'Error'
-                results.append((
+                results.add(
                     number,
                     title,
                     summary,
@@ -351,7 +2034,7 @@ def check_item_os(filename, items, category):
                     match,
                     expected,
                     result
-                ))
+                )
                 if args.verbose:
                     print_verbose(
                         '        '
@@ -369,6 +2052,715 @@ def check_item_os(filename, items, category):
         return
 
 
+def print_check(number, title, summary, default, match, expected, result):
+    """Prints the details of a checked pattern in verbose mode."""
+    print_verbose(
+        '        '
+        'N:{:15.15s}'
+        'D:{:20.20s}'
+        'M:{:20.20s}'
+        'E:{:20.20s}'
+        'R:{:5.5s}'.format(
+            number,
+            default,
+            # Prevent { throwing an error in verbose mode
+            re.sub('{', '{{', match),
+            expected,
+            result
+        ))
+
+
+def result_key(filename, items, category):
+    """Returns the key of the cached results of a file.
+
+    The key covers the contents of the file, the benchmark rows checked on
+    it and every option changing their results.
+    """
+    digest = hashlib.sha256()
+    if is_dirlist_view(filename):
+        digest.update(dirlist_view(filename))
+    else:
+        with open(filename, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    digest.update(repr((
+        __version__, category, items, args.ignorecase, args.windows,
+        args.linux
+    )).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def find_matches(filename, items):
+    """Returns the groups of the first match of every pattern in a file."""
+    lookups = [i for i, item in enumerate(items) if is_lookup(item[0])]
+    if lookups:
+        return find_values(filename, items, lookups)
+    if is_dirlist_view(filename):
+        return search_file(filename, items)
+    size = os.path.getsize(filename)
+    if args.stream is not None and size > args.stream << 20:
+        return search_stream(filename, items)
+    # Large files are decoded on the fly instead of as a whole
+    if size > DECODED_STREAM_SIZE and needs_decoding(filename):
+        return search_stream(filename, items)
+    return search_file(filename, items)
+
+
+def find_values(filename, items, lookups):
+    """Looks up the values of the rows naming a setting instead of a pattern.
+
+    Registry key paths are looked up in the index of a registry export,
+    configuration keys in the settings of a parsed configuration file. The
+    value is returned as the only group of a match, the remaining rows are
+    searched as usual.
+    """
+    found = [None] * len(items)
+    for i in lookups:
+        pattern = items[i][0]
+        stats = profile_stats(filename, pattern)
+        if pattern.startswith(KEY_PREFIX):
+            value = timed(stats, registry_index(filename).lookup,
+                          pattern[len(KEY_PREFIX):])
+            if value is not None and value[0] is None:
+                found[i] = ()
+            elif value is not None:
+                found[i] = (format_registry_value(*value),)
+        else:
+            value = timed(stats, config_index(filename).lookup,
+                          pattern[len(CONF_PREFIX):])
+            if value is not None:
+                found[i] = (value,)
+    others = [i for i in range(len(items)) if i not in lookups]
+    if others:
+        matches = find_matches(filename, [items[i] for i in others])
+        for i, match in zip(others, matches):
+            found[i] = match
+    return found
+
+
+def is_lookup(pattern):
+    """Checks if a row looks up a setting instead of searching a pattern."""
+    return pattern.startswith(KEY_PREFIX) or pattern.startswith(CONF_PREFIX)
+
+
+def config_index(filename):
+    """Returns the settings of a configuration file, parsing it only once."""
+    def parse():
+        with open(filename, 'r', encoding=file_encoding(filename),
+                  errors='replace') as f:
+            return ConfigIndex(f.read(), config_syntax(filename))
+    stat = os.stat(filename)
+    key = (filename, stat.st_mtime_ns, stat.st_size)
+    return cached(config_indexes, key, CONFIG_INDEX_CACHE, parse)
+
+
+def config_syntax(filename):
+    """Returns the syntax of a configuration file, told by its name."""
+    name = os.path.basename(filename)
+    parent = os.path.basename(os.path.dirname(filename))
+    if name in ('sshd_config', 'ssh_config'):
+        return 'sshd'
+    if name == 'sysctl.conf' or parent == 'sysctl.d':
+        return 'sysctl'
+    if parent == 'pam.d':
+        return 'pam'
+    return 'keyvalue'
+
+
+def registry_index(filename):
+    """Returns the index of a registry export, parsing it only once."""
+    stat = os.stat(filename)
+    key = (filename, stat.st_mtime_ns, stat.st_size)
+    return cached(registry_indexes, key, REGISTRY_INDEX_CACHE, lambda:
+                  RegistryIndex(decoded_file(filename, file_encoding(filename))))
+
+
+def parse_registry_data(data):
+    """Returns the (type, value) of the data of a registry export value.
+
+    Returns None for deleted values ("-") and data it cannot decode.
+    """
+    if data.startswith('"') and data.endswith('"') and len(data) > 1:
+        return 'REG_SZ', re.sub(r'\\(.)', r'\1', data[1:-1])
+    if data.startswith('dword:'):
+        try:
+            return 'REG_DWORD', int(data[6:], 16)
+        except ValueError:
+            return None
+    if not data.startswith('hex'):
+        return None
+    kind, _, octets = data.partition(':')
+    try:
+        raw = bytes(int(octet, 16) for octet in octets.split(',') if octet.strip())
+        number = int(kind[4:-1], 16) if kind.startswith('hex(') else 3
+    except ValueError:
+        return None
+    vtype = REGISTRY_TYPES.get(number, 'REG_{}'.format(number))
+    if number in (1, 2, 7):
+        text = raw.decode('utf-16-le', 'replace')
+        if number == 7:
+            return vtype, [item for item in text.split('\0') if item]
+        return vtype, text.split('\0')[0]
+    if number in (4, 11):
+        return vtype, int.from_bytes(raw, 'little')
+    if number == 5:
+        return vtype, int.from_bytes(raw, 'big')
+    return vtype, raw
+
+
+def format_registry_value(vtype, value):
+    """Returns a registry value as the text compared to expected values."""
+    if isinstance(value, int):
+        return str(value)
+    if isinstance(value, list):
+        return ','.join(value)
+    if isinstance(value, bytes):
+        return ','.join('{:02x}'.format(octet) for octet in value)
+    return value
+
+
+def search_file(filename, items):
+    """Searches the contents of a file for every pattern at once."""
+    with open_buffer(filename) as string:
+        binary = not isinstance(string, str)
+        regexes = [compile_check(item[0], binary) for item in items]
+        index = None
+        if (len(string) >= INDEX_THRESHOLD and
+                any(literal_prefix(regex) for regex in regexes)):
+            index = line_index(filename, string)
+        profile_bytes(filename, len(string))
+        regexes = [profiled(regex, filename, item[0])
+                   for regex, item in zip(regexes, items)]
+        return search_all(string, regexes, index)
+
+
+def search_stream(filename, items):
+    """Searches a file chunk by chunk without loading it into memory.
+
+    Patterns which only ever match within a single line are searched in
+    chunks of whole lines, and reading stops as soon as each of them has
+    matched. The remaining patterns still need the file as a whole.
+    """
+    regexes = [profiled(compile_check(item[0], binary=False),
+                        filename, item[0]) for item in items]
+    found = [None] * len(regexes)
+    pending = [i for i, regex in enumerate(regexes)
+               if is_line_local(regex) and not is_backtracking(regex)]
+    with open(filename, 'r', encoding=file_encoding(filename)) as f:
+        for chunk in iter_chunks(f):
+            if not pending:
+                break
+            matches = search_all(chunk, [regexes[i] for i in pending])
+            for i, match in zip(list(pending), matches):
+                if match is not None:
+                    found[i] = match
+                    pending.remove(i)
+        profile_bytes(filename, f.buffer.tell())
+
+    others = [i for i, regex in enumerate(regexes)
+              if not is_line_local(regex) or is_backtracking(regex)]
+    if others:
+        matches = search_file(filename, [items[i] for i in others])
+        for i, match in zip(others, matches):
+            found[i] = match
+    return found
+
+
+def iter_chunks(f, size=CHUNK_SIZE):
+    """Yields the lines of a text file in chunks of whole lines.
+
+    The newline ending a chunk is left out, so that "^" and "$" only match
+    where they would in the whole file. A file ending with a newline (or an
+    empty one) ends with an empty line, just as the whole file does.
+    """
+    ended = True
+    while True:
+        lines = f.readlines(size)
+        if not lines:
+            break
+        ended = lines[-1].endswith('\n')
+        chunk = ''.join(lines)
+        yield chunk[:-1] if ended else chunk
+    if ended:
+        yield ''
+
+
+@contextmanager
+def open_buffer(filename):
+    """Yields the contents of a file, memory-mapped whenever possible.
+
+    The mapped file is searched in place by bytes patterns, which see the
+    same text as str patterns only if it is ASCII with "\\n" line endings.
+    Other files are decoded with universal newlines instead, from the
+    encoding of their byte order mark (e.g. UTF-16 registry exports) or
+    from UTF-8.
+    """
+    if is_dirlist_view(filename):
+        view = dirlist_view(filename)
+        if NOT_PLAIN.search(view) is None:
+            yield view
+        else:
+            yield io.TextIOWrapper(io.BytesIO(view), encoding='utf8').read()
+        return
+    with open(filename, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b''
+            return
+        encoding = sniff_encoding(f.read(4))
+        if encoding == 'utf8':
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if NOT_PLAIN.search(mm) is None:
+                    yield mm
+                    return
+    yield decoded_file(filename, encoding)
+
+
+def decoded_file(filename, encoding):
+    """Returns the text of a file, decoding it with universal newlines.
+
+    Files with a byte order mark are decoded only once per host, as long as
+    the decoded files kept stay within DECODED_FILE_CACHE characters.
+    """
+    stat = os.stat(filename)
+    key = (filename, stat.st_mtime_ns, stat.st_size)
+    with cache_lock:
+        if key in decoded_files:
+            decoded_files.move_to_end(key)
+            return decoded_files[key]
+    with open(filename, 'r', encoding=encoding) as f:
+        text = f.read()
+    if encoding == 'utf8' or len(text) > DECODED_FILE_CACHE:
+        return text
+    with cache_lock:
+        decoded_files[key] = text
+        size = sum(len(value) for value in decoded_files.values())
+        while size > DECODED_FILE_CACHE:
+            size -= len(decoded_files.popitem(last=False)[1])
+    return text
+
+
+def release_files(path):
+    """Drops the decoded files of a host once it has been audited."""
+    prefix = '/'.join([path, ''])
+    with cache_lock:
+        for key in [key for key in decoded_files if key[0].startswith(prefix)]:
+            del decoded_files[key]
+
+
+def needs_decoding(filename):
+    """Checks if bytes patterns cannot search a file as it is on disk."""
+    with open(filename, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return False
+        if sniff_encoding(f.read(4)) != 'utf8':
+            return True
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return NOT_PLAIN.search(mm) is not None
+
+
+def file_encoding(filename):
+    """Returns the encoding of a file, told by its byte order mark."""
+    with open(filename, 'rb') as f:
+        return sniff_encoding(f.read(4))
+
+
+def sniff_encoding(head):
+    """Returns the encoding of the byte order mark the head starts with."""
+    for bom, encoding in BOMS:
+        if head.startswith(bom):
+            return encoding
+    return 'utf8'
+
+
+def compile_check(pattern, binary=True):
+    """Compiles a benchmark pattern to search the raw contents of a file.
+
+    Benchmark patterns are written against file contents with every
+    backslash doubled, so each escaped pair of backslashes in the pattern is
+    collapsed into a single one instead of rewriting the contents.
+    """
+    pattern = pattern.replace('\\\\\\\\', '\\\\')
+    if binary:
+        pattern = pattern.encode('utf-8')
+    return patterns.get(pattern, regex_flags())
+
+
+def check_value(value):
+    """Returns a captured value with backslashes doubled as in the reports."""
+    if isinstance(value, bytes):
+        value = value.decode('utf-8')
+    return value.replace('\\', '\\\\')
+
+
+def regex_flags():
+    """Returns the flags used to compile every benchmark pattern."""
+    return (re.M | re.I) if args.ignorecase else re.M
+
+
+def search_all(string, regexes, index=None):
+    """Finds the first match of every pattern while scanning the string once.
+
+    Patterns are joined into a single alternation, each one wrapped in its
+    own group. The earliest match of the alternation is where the first
+    match of every pattern matching there starts, so those patterns are
+    matched at that position only and dropped from the scan. Patterns with
+    a literal prefix are only tried on the candidate lines of the index, if
+    there is one. The groups of the first match of each pattern are
+    returned, or None if there is none.
+    """
+    found = [None] * len(regexes)
+    pending = []
+    for i, regex in enumerate(regexes):
+        prefix = literal_prefix(regex) if index is not None else None
+        if prefix:
+            ignorecase = bool(regex.flags & re.I)
+            for offset in index.candidates(prefix, ignorecase):
+                match = regex.match(string, offset)
+                if match:
+                    found[i] = match.groups()
+                    break
+        elif is_combinable(regex):
+            pending.append(i)
+        elif is_backtracking(regex):
+            # The profile of a pattern searched elsewhere records the wait
+            found[i] = timed(getattr(regex, 'stats', None), guarded_search,
+                             regex, string)
+        else:
+            match = regex.search(string)
+            if match:
+                found[i] = match.groups()
+
+    pos = 0
+    combined = None
+    while pending:
+        if combined is None:
+            combined, index = combine_patterns(regexes, pending)
+        match = combined.search(string, pos)
+        if not match:
+            break
+        start = match.start()
+        # A pattern matched already hides the others, leave it out
+        if index[match.lastindex] not in pending:
+            combined = None
+            pos = start
+            continue
+        for i in list(pending):
+            match = regexes[i].match(string, start)
+            if match:
+                found[i] = match.groups()
+                pending.remove(i)
+        pos = start + 1
+    return found
+
+
+def guarded_search(regex, string):
+    """Searches a pattern prone to backtracking in a process of its own.
+
+    The process is killed once the pattern runs over its time budget and
+    TIMED_OUT is returned instead of the groups of its first match, or
+    SEARCH_FAILED if the process ends without a result.
+    """
+    import multiprocessing
+    # Forking the auditor itself could deadlock on locks held by the threads
+    # running shell commands, processes start from a clean server instead
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        process_context = multiprocessing.get_context('forkserver')
+    else:
+        process_context = multiprocessing.get_context('spawn')
+    if isinstance(string, mmap.mmap):
+        string = string[:]
+    receiver, sender = process_context.Pipe(duplex=False)
+    process = process_context.Process(
+        target=search_isolated, args=(sender, regex.pattern, regex.flags, string)
+    )
+    process.start()
+    sender.close()
+    try:
+        if not receiver.poll(args.regextimeout):
+            return TIMED_OUT
+        return receiver.recv()
+    except EOFError:
+        return SEARCH_FAILED
+    finally:
+        process.kill()
+        process.join()
+        receiver.close()
+
+
+def search_isolated(sender, pattern, flags, string):
+    """Sends the groups of the first match of a pattern, see guarded_search()."""
+    match = re.compile(pattern, flags).search(string)
+    sender.send(match.groups() if match else None)
+    sender.close()
+
+
+def check_line_local(regex):
+    """Checks if a pattern can only ever match within a single line."""
+    multiline = regex.flags & re.M
+    for op, av in iter_nodes(parse_pattern(regex.pattern, regex.flags)):
+        if op == sre_parse.AT:
+            if av in (sre_parse.AT_BEGINNING_STRING, sre_parse.AT_END_STRING):
+                return False
+            if av in (sre_parse.AT_BEGINNING, sre_parse.AT_END) and \
+                    not multiline:
+                return False
+        elif op == sre_parse.LITERAL and av == 10:
+            return False
+        elif op == sre_parse.NOT_LITERAL and av != 10:
+            return False
+        elif op == sre_parse.ANY and regex.flags & re.S:
+            return False
+        elif op == sre_parse.IN and in_set(10, av):
+            return False
+    return True
+
+
+def in_set(char, items):
+    """Checks if a character belongs to a parsed character set."""
+    negate = False
+    found = False
+    for op, av in items:
+        if op == sre_parse.NEGATE:
+            negate = True
+        elif op == sre_parse.LITERAL:
+            found = found or av == char
+        elif op == sre_parse.RANGE:
+            found = found or av[0] <= char <= av[1]
+        elif op == sre_parse.CATEGORY:
+            found = found or re.match(CATEGORIES[av], chr(char)) is not None
+    return found != negate
+
+
+def combine_patterns(regexes, selected):
+    """Joins the selected patterns into one alternation of groups.
+
+    Returns the compiled alternation and a mapping from the number of each
+    wrapping group to the position of its pattern.
+    """
+    if isinstance(regexes[selected[0]].pattern, bytes):
+        lparen, rparen, bar = b'(', b')', b'|'
+    else:
+        lparen, rparen, bar = '(', ')', '|'
+    index = {}
+    group = 1
+    sources = []
+    for i in selected:
+        index[group] = i
+        group += 1 + regexes[i].groups
+        sources.append(lparen + regexes[i].pattern + rparen)
+    # Alternations of the patterns still pending are kept apart from the
+    # shared patterns, only the last used ones stay compiled
+    key = (bar.join(sources), regexes[selected[0]].flags)
+    return cached(combined_patterns, key, COMBINED_PATTERN_CACHE,
+                  lambda: re.compile(*key)), index
+
+
+def check_combinable(regex):
+    """Checks if a pattern keeps its meaning inside a larger alternation."""
+    flags = regex.flags & ~re.UNICODE
+    if flags != regex_flags() or regex.groupindex:
+        return False
+    # Global flags of the pattern would no longer start the alternation
+    source = regex.pattern
+    if isinstance(source, bytes):
+        source = source.decode('latin-1')
+    if INLINE_FLAGS.match(source):
+        return False
+    # Back references would point to the wrong groups after wrapping
+    for op, av in iter_nodes(parse_pattern(regex.pattern, flags)):
+        if op in (sre_parse.GROUPREF, sre_parse.GROUPREF_EXISTS):
+            return False
+    # Anything else the alternation would not compile with is searched alone
+    try:
+        re.compile('({})|()'.format(source), flags)
+    except re.error:
+        return False
+    return True
+
+
+def pattern_info(regex):
+    """Returns what the search engine needs to know about a pattern.
+
+    Patterns are analysed once, patterns of a compiled benchmark are loaded
+    already analysed.
+    """
+    key = (regex.pattern, regex.flags)
+    info = pattern_infos.get(key)
+    if info is None:
+        # Patterns prone to backtracking are searched on their own only
+        backtracking = check_backtracking(regex)
+        info = pattern_infos[key] = PatternInfo(
+            None if backtracking else find_literal_prefix(regex),
+            check_line_local(regex),
+            check_combinable(regex) and not backtracking,
+            backtracking
+        )
+    return info
+
+
+def literal_prefix(regex):
+    """Returns the literal text a pattern requires at the start of a line."""
+    return pattern_info(regex).prefix
+
+
+def is_line_local(regex):
+    """Checks if a pattern can only ever match within a single line."""
+    return pattern_info(regex).line_local
+
+
+def is_combinable(regex):
+    """Checks if a pattern keeps its meaning inside a larger alternation."""
+    return pattern_info(regex).combinable
+
+
+def is_backtracking(regex):
+    """Checks if a pattern may take exponential time to search."""
+    return pattern_info(regex).backtracking
+
+
+def line_index(filename, string):
+    """Returns the line index of a file, building it only once per file."""
+    stat = os.stat(source_file(filename))
+    key = (filename, stat.st_mtime_ns, stat.st_size)
+    return cached(line_indexes, key, LINE_INDEX_CACHE,
+                  lambda: LineIndex(string))
+
+
+def find_literal_prefix(regex):
+    """Returns the literal text a pattern requires at the start of a line.
+
+    Only patterns starting with "^" in multi-line mode qualify, the prefix
+    ends at the first non-literal item or at the first space or tab. Returns
+    None if the pattern has no such prefix.
+    """
+    if not regex.flags & re.M:
+        return None
+    nodes = iter(parse_pattern(regex.pattern, regex.flags))
+    if next(nodes, None) != (sre_parse.AT, sre_parse.AT_BEGINNING):
+        return None
+    chars = []
+    for op, av in nodes:
+        if op != sre_parse.LITERAL or av in (0x09, 0x20):
+            break
+        chars.append(av)
+    if not chars:
+        return None
+    if isinstance(regex.pattern, bytes):
+        return bytes(chars)
+    prefix = ''.join(map(chr, chars))
+    # Non-ASCII characters have case insensitive matches outside the index
+    if regex.flags & re.I and not prefix.isascii():
+        return None
+    return prefix
+
+
+def check_backtracking(regex):
+    """Checks if a pattern may take exponential time to search.
+
+    Patterns repeating a subpattern which itself repeats a variable number
+    of times, such as "(a+)+" or "(\\w+\\s?)*", or which holds alternatives
+    able to match the same text, such as "(a|aa)+", can match the same text
+    in exponentially many ways the engine tries one by one on a failed match.
+    """
+    ignorecase = bool(regex.flags & re.I)
+    for op, av in iter_nodes(parse_pattern(regex.pattern, regex.flags)):
+        if op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT) and \
+                av[1] == sre_parse.MAXREPEAT:
+            for inner, value in iter_nodes(av[2]):
+                if inner in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT) and \
+                        value[0] != value[1]:
+                    return True
+                if inner == sre_parse.BRANCH and \
+                        overlapping_branches(value[1], ignorecase):
+                    return True
+    return False
+
+
+def overlapping_branches(branches, ignorecase=False):
+    """Checks if some alternatives of a branch may match the same text.
+
+    Two alternatives cannot match the same text if they match disjoint sets
+    of characters at some position of their fixed leading items. Others,
+    e.g. those which may match the empty string, are taken to overlap.
+    """
+    leads = [leading_chars(branch, ignorecase) for branch in branches]
+    for i, lead in enumerate(leads):
+        for other in leads[:i]:
+            if not any(not (a & b) for a, b in zip(lead, other)):
+                return True
+    return False
+
+
+def leading_chars(subpattern, ignorecase=False):
+    """Returns the sets of characters the leading items of a pattern match.
+
+    The list stops at the first item not matching a single character out
+    of a known set, only the first character of a repeat is included.
+    """
+    sets = []
+    for op, av in subpattern:
+        if op == sre_parse.AT:
+            continue
+        if op == sre_parse.LITERAL:
+            sets.append({av})
+        elif op == sre_parse.IN and set_chars(av) is not None:
+            sets.append(set_chars(av))
+        elif op == sre_parse.SUBPATTERN:
+            sets.extend(leading_chars(av[-1]))
+            break
+        elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT) and av[0] > 0:
+            sets.extend(leading_chars(av[2])[:1])
+            break
+        else:
+            break
+    if ignorecase:
+        sets = [chars | {ord(chr(char).swapcase()[0]) for char in chars}
+                for chars in sets]
+    return sets
+
+
+def set_chars(items):
+    """Returns the characters of a small parsed character set, or None."""
+    chars = set()
+    for op, av in items:
+        if op == sre_parse.LITERAL:
+            chars.add(av)
+        elif op == sre_parse.RANGE and av[1] - av[0] < 256:
+            chars.update(range(av[0], av[1] + 1))
+        else:
+            return None
+    return chars
+
+
+def parse_pattern(pattern, flags=0):
+    """Returns the parsed syntax tree of a regex pattern."""
+    return sre_parse.parse(pattern, flags)
+
+
+def iter_nodes(subpattern):
+    """Yields every (opcode, argument) node of a parsed regex recursively."""
+    for op, av in subpattern:
+        yield op, av
+        if op == sre_parse.SUBPATTERN:
+            children = [av[-1]]
+        elif op == sre_parse.BRANCH:
+            children = av[1]
+        elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT,
+                    getattr(sre_parse, 'POSSESSIVE_REPEAT', None)):
+            children = [av[2]]
+        elif op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+            children = [av[1]]
+        elif op == getattr(sre_parse, 'ATOMIC_GROUP', None):
+            children = [av]
+        elif op == sre_parse.GROUPREF_EXISTS:
+            children = [av[1]] + ([av[2]] if av[2] else [])
+        else:
+            children = []
+        for child in children:
+            for node in iter_nodes(child):
+                yield node
+
+
 def check_item_default(default, expected):
     """Checks the default value when the specific setting is not available."""
     if expected[:1] in ['>', '<'] and not default.startswith('Not '):
@@ -391,36 +2783,49 @@ def check_item_relational(actual, expected):
         return False
 
 
-def check_item_database(filename, items, category):
+def check_item_database(filename, items, category, results):
     """Checks every query listed in the loaded CSV file."""
-    global results, total, passed, failed, errors
+    if os.path.isfile(filename):
+        profile_bytes(filename, os.path.getsize(filename))
     try:
         for query, number, title, summary, default, expected in items:
-            query = query.format(filename)
             if args.verbose:
-                print_verbose('      {}'.format(query))
+                print_verbose('      {}'.format(query.format(filename)))
             if not os.path.isfile(filename):
                 raise IOError('{} not found!'.format(filename))
-            total += 1
-            params = ['q', '-H', '-d', ';', query]
-            output = str(check_output(params, shell=True).strip())
+            wall, cpu = time.perf_counter(), time.thread_time()
+            output = query_database(filename, query)
+            if output is None:
+                from subprocess import check_output
+                from subprocess import CalledProcessError
+                params = ['q', '-H', '-d', ';', query.format(filename)]
+                try:
+                    output = check_output(params, shell=True)
+                except CalledProcessError as err:
+                    print_error('Error: {}'.format(err))
+                    output = None
+            stats = profile_stats(filename, query)
+            if stats is not None:
+                add_cost(stats, wall, cpu)
+            # Neither SQLite nor q could run the query
+            if output is None:
+                results.add(number, title, summary, default, 'N/A', expected,
+                            'Error')
+                continue
+            output = str(output.strip())
             if output.startswith('b\''):
                 output = output[2:-1]
             if category is True:
                 if output == expected:
-                    passed += 1
                     result = 'Pass'
                 else:
-                    failed += 1
                     result = 'Fail'
             elif category is False:
                 if output:
-                    failed += 1
                     result = 'Fail'
                 else:
-                    passed += 1
                     result = 'Pass'
-            results.append((
+            results.add(
                 number,
                 title,
                 summary,
@@ -428,15 +2833,13 @@ def check_item_database(filename, items, category):
                 output,
                 expected,
                 result
-            ))
+            )
         if not args.verbose:
             print_good('OK!')
     except (IOError, OSError) as err:
         print_error('Error: {}'.format(err))
         for query, number, title, summary, default, expected in items:
-            total += 1
-            errors += 1
-            results.append((
+            results.add(
                 number,
                 title,
                 summary,
@@ -444,102 +2847,190 @@ def check_item_database(filename, items, category):
                 'N/A',
                 expected,
                 'Error'
-            ))
+            )
         return
 
 
-def create_html_report(filename):
-    """Creates a nice HTML report from the results."""
-    title = 'Security Audit Report ({})'.format(time.strftime('%m/%d/%Y'))
-    doc = dominate.document(title=title)
-    with doc:
-        styles = [
-            'margin:0;padding:0;',
-            'border:1px solid black;',
-            'margin-top:0;',
-            'margin-bottom:0',
-        ]
-        colors = {
-            'Pass': 'lime',
-            'Fail': 'red',
-            'Error': 'yellow',
-        }
-
-        for line in banner.splitlines():
-            line = re.sub(r' {20}', '     ', line)
-            pre(line, style='margin:0;font-size:16px;font-weight:bold')
-        h1(title, style=styles[3])
-        h4(audit['benchmark'], style=styles[0])
-
-        p('Performed %d tests in total:' % total, style=styles[3])
-        l = ul(style=styles[2])
-        l += li('Pass = {} ({:.0f}%)'.format(passed, passed/float(total)*100))
-        l += li('Fail = {} ({:.0f}%)'.format(failed, failed/float(total)*100))
-        l += li('Error = {} ({:.0f}%)'.format(errors, errors/float(total)*100))
-
-        t = table(
-            border=1,
-            width='100%',
-            cellspacing='0',
-            cellpadding='3',
-            style=styles[1]
+def query_database(filename, query):
+    """Runs a query on an exported CSV file like q, but in process.
+
+    Every export is loaded once into an in-memory SQLite table, the output
+    is formatted the way "q -H -d ;" prints it. Returns None if SQLite
+    cannot run the query, so that q can be tried instead.
+    """
+    import csv
+    import sqlite3
+    stat = os.stat(filename)
+    key = (filename, stat.st_mtime_ns, stat.st_size)
+    connection = cached(databases, key, DATABASE_CACHE,
+                        lambda: load_database(filename))
+    if connection is None:
+        return None
+    try:
+        rows = connection.execute(query.format(DATABASE_TABLE)).fetchall()
+    except sqlite3.Error as err:
+        if args.debug:
+            print_verbose('      SQLite failed ({}), using q', err)
+        return None
+    output = io.StringIO()
+    w = csv.writer(output, delimiter=';', lineterminator='\n')
+    for row in rows:
+        w.writerow(['' if value is None else value for value in row])
+    return output.getvalue().encode('utf-8')
+
+
+def load_database(filename):
+    """Loads an exported CSV file with a header into an SQLite table.
+
+    Column types are inferred like q does: columns of integers or numbers
+    hold integers or floats, any other column holds text. Returns None if
+    SQLite cannot hold the export, e.g. without or with duplicate columns.
+    """
+    import csv
+    import sqlite3
+    with open(filename, 'r', encoding='utf-8', newline='') as f:
+        reader = csv.reader(f, delimiter=';')
+        header = next(reader, [])
+        rows = [(row + [''] * len(header))[:len(header)] for row in reader]
+
+    types = []
+    for i in range(len(header)):
+        values = [row[i] for row in rows if row[i] != '']
+        if values and all(INTEGER.match(value) for value in values):
+            types.append(('INTEGER', int))
+        elif values and all(REAL.match(value) for value in values):
+            types.append(('REAL', float))
+        else:
+            types.append(('TEXT', str))
+
+    # Auditors in other threads may query the same table
+    connection = sqlite3.connect(':memory:', check_same_thread=False)
+    try:
+        connection.execute('CREATE TABLE {} ({})'.format(
+            DATABASE_TABLE, ', '.join(
+                '"{}" {}'.format(name.replace('"', '""'), sqltype)
+                for name, (sqltype, _) in zip(header, types))))
+        connection.executemany('INSERT INTO {} VALUES ({})'.format(
+            DATABASE_TABLE, ', '.join('?' * len(header))), (
+            [None if value == '' and convert is not str else convert(value)
+             for value, (_, convert) in zip(row, types)]
+            for row in rows))
+    except sqlite3.Error as err:
+        if args.debug:
+            print_verbose('      SQLite cannot load {} ({}), using q'.format(
+                filename, err))
+        connection.close()
+        return None
+    return connection
+
+
+def row_key(row):
+    """Returns the sort key of a result, ordering results by chapter."""
+    return chapter_key(row[0]), row
+
+
+def chapter_key(number):
+    """Returns the natural sort key of a chapter number.
+
+    Numeric parts compare as numbers and other parts as text, so "9.2.1a"
+    sorts after "9.2.1" and before "9.2.2". Keys of the chapters of loaded
+    benchmarks are computed once at load time.
+    """
+    key = chapter_keys.get(number)
+    if key is None:
+        key = chapter_keys[number] = tuple(
+            (0, int(part)) if part.isdecimal() else (1, part)
+            for part in CHAPTER_PARTS.findall(number)
         )
+    return key
+
 
-        with t.add(thead(border=1, style=styles[1])):
-            l = tr()
-            for header in headers:
-                l += th(header, bgcolor='black', style='color:white')
-        with t.add(tbody(border=1, style=styles[1])):
-            for number, title, summary, default, actual, expected, result in sorted(set(results), key=lambda x: tuple(map(int, x[0].split('.')))):
-                l = tr(style='border:1px solid black')
-                l += td(number, align='left', width='5%', style=styles[1])
-                l += td(title, align='left', width='32%', style=styles[1])
-                l += td(summary, align='left', width='30%', style=styles[1])
-                l += td(default, align='left', width='10%', style=styles[1])
-                l += td(actual, align='left', width='10%', style=styles[1])
-                l += td(expected, align='left', width='10%', style=styles[1])
-                l += td(result, align='center', bgcolor=colors[result], style=styles[1])
+def create_html_report(filename, results, benchmark):
+    """Creates a nice HTML report from the results.
 
+    The report is written row by row from templates, cells are styled by
+    the shared rules of the stylesheet instead of inline styles.
+    """
+    from html import escape
+    title = 'Security Audit Report ({})'.format(time.strftime('%m/%d/%Y'))
+    total = results.total or 1
     print_status('  Creating {}', filename)
     with open(filename, 'w') as f:
-        f.write(str(doc))
+        f.write(HTML_HEADER.format(
+            title=escape(title, False),
+            style=HTML_STYLE,
+            banner=escape(re.sub(r' {20}', '     ', banner), False),
+            benchmark=escape(benchmark, False),
+            total=results.total,
+            passed=results.passed,
+            failed=results.failed,
+            errors=results.errors,
+            passed_percent=results.passed / float(total) * 100,
+            failed_percent=results.failed / float(total) * 100,
+            errors_percent=results.errors / float(total) * 100,
+            headers=''.join('<th>{}</th>'.format(header) for header in headers)
+        ))
+        for row in results.rows():
+            f.write(HTML_ROW.format(*[escape(value, False) for value in row]))
+        f.write(HTML_FOOTER)
+        print_good('OK!')
+
+
+def create_summary_report(filename, summary):
+    """Creates a CSV summary of a batch audit with one row per host."""
+    import csv
+    print_status('  Creating {}', filename)
+    with open(filename, 'w', newline='') as f:
+        w = csv.writer(f, delimiter=';')
+        w.writerow(['Host', 'Benchmark', 'Total', 'Pass', 'Fail', 'Error'])
+        for row in summary:
+            w.writerow(row)
         print_good('OK!')
 
 
-def create_csv_report(filename):
+def create_csv_report(filename, results):
     """Creates a CSV report from the results."""
+    import csv
     print_status('  Creating {}', filename)
     with open(filename, 'w', newline='') as f:
         w = csv.writer(f, delimiter=';')
         w.writerow(headers)
-        for number, title, summary, default, actual, expected, result in sorted(set(results), key=lambda x: tuple(map(int, x[0].split('.')))):
+        for number, title, summary, default, actual, expected, result in results.rows():
             w.writerow([number, title, summary, default, actual, expected, result])
         print_good('OK!')
 
 
 def print_info(info_msg, format_string=''):
-    print(BLUE + '[*] ' + info_msg.format(format_string) + WHITE)
+    print(BLUE + '[*] ' + info_msg.format(format_string) + WHITE,
+          file=context.output)
 
 
 def print_status(status_msg, format_string=''):
-    print(WHITE + '[+] ' + status_msg.format(format_string) + WHITE, end='')
+    print(WHITE + '[+] ' + status_msg.format(format_string) + WHITE,
+          end='', file=context.output)
 
 
 def print_good(good_msg, format_string=''):
-    print(' ' + GREEN + good_msg.format(format_string) + WHITE)
+    print(' ' + GREEN + good_msg.format(format_string) + WHITE,
+          file=context.output)
 
 
 def print_error(error_msg, format_string=''):
-    print(' ' + RED + error_msg.format(format_string) + WHITE)
+    print(' ' + RED + error_msg.format(format_string) + WHITE,
+          file=context.output)
 
 
 def print_warning(warning_msg, format_string=''):
-    print(RED + '[!] ' + warning_msg.format(format_string) + WHITE)
+    print(RED + '[!] ' + warning_msg.format(format_string) + WHITE,
+          file=context.output)
 
 
 def print_verbose(verbose_msg, format_string=''):
-    print(GREY + '[V] ' + verbose_msg.format(format_string) + WHITE)
+    print(GREY + '[V] ' + verbose_msg.format(format_string) + WHITE,
+          file=context.output)
 
 
 if __name__ == "__main__":
+    print(banner)
+    configure(parse_args())
     main()